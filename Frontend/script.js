@@ -132,11 +132,37 @@ class CurtainControl {
             if (!response.ok) {
                 throw new Error(response.statusText);
             }
+            // Asynchronous control: the command was queued, wait for its outcome
+            if (response.status === 202) {
+                const queued = await response.json();
+                const job = await this.waitForJob(queued.job_id);
+                if (job.status === 'failed') {
+                    throw new Error(job.message || 'Command failed');
+                }
+            }
         } catch (err) {
             this.showError(`Failed to ${direction} curtain: ${err.toString()}`);
         }
     }
 
+    async waitForJob(jobId) {
+        // Long-poll the job until it finishes (the server holds each request up to `wait` seconds)
+        for (let attempt = 0; attempt < 5; attempt++) {
+            const response = await fetch(`/api/jobs/${jobId}?wait=20`, {
+                credentials: 'include',
+                headers: { 'Accept': 'application/json' }
+            });
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            const job = await response.json();
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+        }
+        throw new Error('Timed out waiting for the command');
+    }
+
     addRoom() {
         // Check if user is authenticated
         if (window.isAuthenticated === false) {
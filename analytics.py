@@ -0,0 +1,238 @@
+"""
+Analytics module - pre-aggregated usage buckets per room.
+
+Besides the daily CSVs kept by StatisticsManager, every command is counted in a
+fixed-size record per room and year:
+
+    hour of week (7 x 24) x action (up, down, stop)
+    week of year (53)     x action
+
+as unsigned 32-bit counters, in ANALYTICS_DIR/usage_<year>.bin. The room of each
+record is the matching line of usage_<year>.rooms. An update is a locked read and
+write of one counter; queries read the year once and sum whole records column-wise,
+so a heatmap or top-N over a year of data never touches the CSVs.
+
+Commands are counted from the release that added this module on. The days before can
+be replayed from the statistics with `python maintenance.py backfill-analytics`; the
+CSVs only have daily totals, so the backfill fills the week-of-year buckets (and with
+them the top rooms) but not the hour-of-week heatmap.
+"""
+
+import logging
+import os
+import threading
+from array import array
+from datetime import date, datetime
+from operator import add
+from typing import Optional
+
+from config import ANALYTICS_DIR
+from utils import file_lock
+
+ACTIONS = ('up', 'down', 'stop')
+HOURS_OF_WEEK = 7 * 24
+WEEKS = 53
+HOURLY_SIZE = HOURS_OF_WEEK * len(ACTIONS)
+RECORD_SIZE = HOURLY_SIZE + WEEKS * len(ACTIONS)
+COUNTER_BYTES = array('I').itemsize
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+BACKFILL_MARKER = 'usage_backfilled'
+
+_rooms_cache = {}  # year -> (size of the rooms file, [rooms], {room: record index})
+_year_cache = {}  # year -> ((mtime, size), rooms, counters)
+_lock = threading.Lock()
+
+
+def _paths(year: int):
+    base = os.path.join(ANALYTICS_DIR, f"usage_{year}")
+    return base + '.bin', base + '.rooms'
+
+
+def _load_rooms(year: int):
+    """Rooms of a year in record order, and their record indexes."""
+    _, rooms_path = _paths(year)
+    try:
+        size = os.path.getsize(rooms_path)
+    except FileNotFoundError:
+        return [], {}
+    cached = _rooms_cache.get(year)
+    if cached and cached[0] == size:
+        return cached[1], cached[2]
+    with open(rooms_path, 'r', encoding='utf-8') as f:
+        rooms = f.read().split('\n')[:-1]
+    slots = {room: slot for slot, room in enumerate(rooms)}
+    _rooms_cache[year] = (size, rooms, slots)
+    return rooms, slots
+
+
+def _room_slot(year: int, room: str) -> int:
+    """Index of the room's record, appending a new record for a new room. Call under the file lock."""
+    rooms, slots = _load_rooms(year)
+    if room in slots:
+        return slots[room]
+
+    data_path, rooms_path = _paths(year)
+    slot = len(rooms)
+    with open(data_path, 'ab') as f:
+        f.truncate((slot + 1) * RECORD_SIZE * COUNTER_BYTES)
+    with open(rooms_path, 'a', encoding='utf-8') as f:
+        f.write(room + '\n')
+    return slot
+
+
+def record(room: str, action: str, when: Optional[datetime] = None):
+    """Count one command for a room in its hour-of-week and week-of-year buckets."""
+    when = when or datetime.now()
+    action_index = ACTIONS.index(action)
+    hour_of_week = when.weekday() * 24 + when.hour
+    week = (when.timetuple().tm_yday - 1) // 7
+    offsets = (
+        hour_of_week * len(ACTIONS) + action_index,
+        HOURLY_SIZE + week * len(ACTIONS) + action_index,
+    )
+
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    data_path, _ = _paths(when.year)
+    with file_lock(data_path):
+        slot = _room_slot(when.year, room)
+        fd = os.open(data_path, os.O_RDWR)
+        try:
+            for offset in offsets:
+                position = (slot * RECORD_SIZE + offset) * COUNTER_BYTES
+                counter = array('I', os.pread(fd, COUNTER_BYTES, position))
+                counter[0] += 1
+                os.pwrite(fd, counter.tobytes(), position)
+        finally:
+            os.close(fd)
+
+
+def _load_year(year: int):
+    """Rooms and counters of a year, re-read only when the data file changed."""
+    data_path, _ = _paths(year)
+    try:
+        stat = os.stat(data_path)
+    except FileNotFoundError:
+        return [], array('I')
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _year_cache.get(year)
+    if cached and cached[0] == key:
+        return cached[1], cached[2]
+
+    with _lock:
+        counters = array('I')
+        with open(data_path, 'rb') as f:
+            counters.frombytes(f.read())
+        rooms, _ = _load_rooms(year)
+        # A room appended after the read has no record yet, and vice versa
+        slots = min(len(rooms), len(counters) // RECORD_SIZE)
+        rooms = rooms[:slots]
+        _year_cache[year] = (key, rooms, counters)
+    return rooms, counters
+
+
+def _records(year: int, building: Optional[str] = None, room: Optional[str] = None):
+    rooms, counters = _load_year(year)
+    for slot, name in enumerate(rooms):
+        if room and name != room:
+            continue
+        if building and name[1:2] != building:
+            continue
+        yield name, memoryview(counters)[slot * RECORD_SIZE:(slot + 1) * RECORD_SIZE]
+
+
+def _action_indexes(action: Optional[str]):
+    return [ACTIONS.index(action)] if action else range(len(ACTIONS))
+
+
+def get_heatmap(year: int, building: Optional[str] = None, room: Optional[str] = None,
+                action: Optional[str] = None) -> dict:
+    """Commands per weekday and hour, and per week of the year, summed over the selected rooms."""
+    totals = [0] * RECORD_SIZE
+    room_count = 0
+    for _, counters in _records(year, building, room):
+        totals = list(map(add, totals, counters))
+        room_count += 1
+
+    indexes = _action_indexes(action)
+    hourly = [sum(totals[hour * len(ACTIONS) + index] for index in indexes) for hour in range(HOURS_OF_WEEK)]
+    weekly = [sum(totals[HOURLY_SIZE + week * len(ACTIONS) + index] for index in indexes) for week in range(WEEKS)]
+    return {
+        "year": year,
+        "building": building,
+        "room": room,
+        "action": action,
+        "rooms": room_count,
+        "days": list(DAYS),
+        "heatmap": [hourly[day * 24:(day + 1) * 24] for day in range(7)],
+        "weekly": weekly,
+        "total": sum(weekly),
+    }
+
+
+def get_top_rooms(year: int, building: Optional[str] = None, action: Optional[str] = None, limit: int = 10) -> list:
+    """Rooms with the most commands in a year, with their per-action counts."""
+    results = []
+    for name, counters in _records(year, building):
+        weekly = counters[HOURLY_SIZE:]
+        counts = {ACTIONS[index]: sum(weekly[index::len(ACTIONS)]) for index in range(len(ACTIONS))}
+        total = counts[action] if action else sum(counts.values())
+        if total:
+            results.append({"room": name, **counts, "total": total})
+    results.sort(key=lambda entry: entry["total"], reverse=True)
+    return results[:limit]
+
+
+def backfill(rows, before: date) -> dict:
+    """
+    Add daily statistics rows ({'date', 'room_number', 'up', 'down', 'stop'}) from before
+    `before` (the day counting started) to the week-of-year buckets. Runs once: a marker
+    in ANALYTICS_DIR keeps it from counting the same days twice.
+
+    Returns:
+        dict: The years and number of rooms and commands added
+    """
+    marker = os.path.join(ANALYTICS_DIR, BACKFILL_MARKER)
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            raise ValueError(f"analytics were already backfilled ({f.read().strip()})")
+
+    weekly = {}  # year -> {room: [week x action counters]}
+    for row in rows:
+        day = date.fromisoformat(row['date'])
+        if day >= before:
+            continue
+        counters = weekly.setdefault(day.year, {}).setdefault(row['room_number'], [0] * (WEEKS * len(ACTIONS)))
+        week = (day.timetuple().tm_yday - 1) // 7
+        for index, action in enumerate(ACTIONS):
+            counters[week * len(ACTIONS) + index] += row[action]
+
+    os.makedirs(ANALYTICS_DIR, exist_ok=True)
+    commands = 0
+    for year, rooms in sorted(weekly.items()):
+        data_path, _ = _paths(year)
+        with file_lock(data_path):
+            for room, counts in rooms.items():
+                slot = _room_slot(year, room)
+                position = (slot * RECORD_SIZE + HOURLY_SIZE) * COUNTER_BYTES
+                fd = os.open(data_path, os.O_RDWR)
+                try:
+                    stored = array('I', os.pread(fd, len(counts) * COUNTER_BYTES, position))
+                    os.pwrite(fd, array('I', map(add, stored, counts)).tobytes(), position)
+                finally:
+                    os.close(fd)
+                commands += sum(counts)
+
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(f"days before {before.isoformat()}, on {datetime.now().isoformat(timespec='seconds')}\n")
+    summary = {"years": sorted(weekly), "rooms": sum(len(rooms) for rooms in weekly.values()), "commands": commands}
+    logging.info(f"Backfilled analytics: {summary}")
+    return summary
+
+
+def safe_record(room: str, action: str):
+    """record(), logging instead of raising so analytics never fail a command."""
+    try:
+        record(room, action)
+    except Exception as e:
+        logging.error(f"Failed to record analytics for room {room}: {e}")
@@ -0,0 +1,205 @@
+"""
+Assets module - fingerprinted, precompressed static files.
+
+`python assets.py` builds Frontend/ into ASSETS_BUILD_DIR:
+  - every asset is copied under its original name and under a content-hashed name
+    (css/style.css -> css/style.<hash>.css),
+  - references in the HTML pages and CSS files are rewritten to the hashed names,
+  - text assets get .gz (and .br when the brotli package is installed) variants,
+  - manifest.json maps original paths to hashed paths, ETags and encodings.
+
+nginx can serve the build directory directly (see configs/nginx/curtains). When the
+app serves it itself, AssetFiles adds immutable caching for hashed files, strong
+ETags from the manifest and picks a precompressed variant from Accept-Encoding.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from compression import choose_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.ico', '.txt', '.md')
+# Pages are entry points reached by fixed URLs, so they keep their names
+PAGE_EXTENSIONS = ('.html',)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+_REFERENCE_PATTERNS = (
+    re.compile(r'''(?P<prefix>(?:src|href)=["'])(?P<url>[^"'#?]+)'''),
+    re.compile(r'''(?P<prefix>url\(\s*["']?)(?P<url>[^"')#?]+)'''),
+)
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def _hashed_name(rel_path: str, digest: str) -> str:
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{digest}{ext}"
+
+
+def _rewrite_references(text: str, rel_path: str, hashed: dict, url_prefix: str) -> str:
+    """Point relative and /Frontend/ references in a page or stylesheet at hashed files."""
+    base_dir = os.path.dirname(rel_path)
+
+    def replace(match):
+        url = match.group('url')
+        if url.startswith(url_prefix):
+            target = url[len(url_prefix):]
+            if target in hashed:
+                return match.group('prefix') + url_prefix + hashed[target]
+            return match.group(0)
+        if '://' in url or url.startswith(('/', 'data:', 'mailto:')):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(base_dir, url)).replace(os.sep, '/')
+        if target in hashed:
+            rewritten = os.path.relpath(hashed[target], base_dir or '.').replace(os.sep, '/')
+            return match.group('prefix') + rewritten
+        return match.group(0)
+
+    for pattern in _REFERENCE_PATTERNS:
+        text = pattern.sub(replace, text)
+    return text
+
+
+def _write_variants(path: str, data: bytes) -> list:
+    """Write precompressed variants next to path and return the encodings produced."""
+    encodings = []
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+        encodings.append('br')
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    encodings.append('gzip')
+    return encodings
+
+
+def build(source_dir: str, output_dir: str, url_prefix: str = '/Frontend/') -> dict:
+    """Build fingerprinted and precompressed assets from source_dir into output_dir."""
+    files = {}
+    for root, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            full_path = os.path.join(root, filename)
+            rel_path = os.path.relpath(full_path, source_dir).replace(os.sep, '/')
+            with open(full_path, 'rb') as f:
+                files[rel_path] = f.read()
+
+    # Stylesheets can reference images, so hash everything except pages and stylesheets
+    # first, then rewrite and hash the stylesheets, then rewrite the pages
+    hashed = {}
+    contents = dict(files)
+    for rel_path, data in files.items():
+        if not rel_path.endswith(PAGE_EXTENSIONS + ('.css',)):
+            hashed[rel_path] = _hashed_name(rel_path, _content_hash(data))
+    for rel_path, data in files.items():
+        if rel_path.endswith('.css'):
+            contents[rel_path] = _rewrite_references(data.decode('utf-8'), rel_path, hashed, url_prefix).encode('utf-8')
+            hashed[rel_path] = _hashed_name(rel_path, _content_hash(contents[rel_path]))
+    for rel_path, data in files.items():
+        if rel_path.endswith(PAGE_EXTENSIONS):
+            contents[rel_path] = _rewrite_references(data.decode('utf-8'), rel_path, hashed, url_prefix).encode('utf-8')
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+
+    manifest = {"assets": {}, "files": {}}
+    for rel_path, data in contents.items():
+        targets = [rel_path] + ([hashed[rel_path]] if rel_path in hashed else [])
+        etag = _content_hash(data)
+        for target in targets:
+            out_path = os.path.join(output_dir, target)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as f:
+                f.write(data)
+            encodings = _write_variants(out_path, data) if target.endswith(COMPRESSIBLE_EXTENSIONS) else []
+            manifest["files"][target] = {
+                "etag": etag,
+                "size": len(data),
+                "immutable": target != rel_path,
+                "encodings": encodings,
+            }
+        if rel_path in hashed:
+            manifest["assets"][rel_path] = hashed[rel_path]
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(build_dir: str):
+    """Load the build manifest, or None when no build exists."""
+    try:
+        with open(os.path.join(build_dir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (IOError, json.JSONDecodeError):
+        return None
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles for a build directory: cache headers, strong ETags and precompressed variants."""
+
+    def __init__(self, *, directory: str, manifest: dict, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.manifest_files = manifest["files"]
+        self.root = os.path.realpath(directory)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        rel_path = os.path.relpath(os.path.realpath(full_path), self.root).replace(os.sep, '/')
+        entry = self.manifest_files.get(rel_path)
+        if entry is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""),
+                                   [encoding for encoding in ("br", "gzip") if encoding in entry["encodings"]])
+        headers = {
+            # Each encoded representation needs its own strong ETag
+            "etag": f'"{entry["etag"]}-{encoding}"' if encoding else f'"{entry["etag"]}"',
+            "cache-control": IMMUTABLE_CACHE_CONTROL if entry["immutable"] else REVALIDATE_CACHE_CONTROL,
+        }
+        if entry["encodings"]:
+            headers["vary"] = "Accept-Encoding"
+        if_none_match = [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")]
+        if headers["etag"] in if_none_match or "*" in if_none_match:
+            return NotModifiedResponse(headers)
+
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        if encoding:
+            headers["content-encoding"] = encoding
+            full_path = full_path + (".br" if encoding == "br" else ".gz")
+            stat_result = os.stat(full_path)
+        return FileResponse(full_path, status_code=status_code, headers=headers, media_type=media_type,
+                            stat_result=stat_result)
+
+
+def main():
+    from config import ASSETS_BUILD_DIR
+
+    manifest = build('Frontend', ASSETS_BUILD_DIR)
+    encodings = 'br+gzip' if brotli is not None else 'gzip (install brotli for .br variants)'
+    print(f"Built {len(manifest['files'])} files ({len(manifest['assets'])} fingerprinted, {encodings}) "
+          f"into {ASSETS_BUILD_DIR}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,6 @@ import base64
 from functools import wraps
 
 from fastapi import HTTPException
-from msal import ConfidentialClientApplication
 from starlette.responses import RedirectResponse
 
 
@@ -62,6 +61,9 @@ def log_env_vars():
 
 
 def get_auth_app():
+    # msal is only needed once a login actually happens, keep it off the worker boot path
+    from msal import ConfidentialClientApplication
+
     log_env_vars()
     cert_data = get_certificate_from_file()
 
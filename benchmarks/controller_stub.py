@@ -0,0 +1,149 @@
+"""
+Local fake of the building controller's /iphone/send protocol.
+
+Speaks the same request format as helper.send_message (CRLF separated key=value
+lines) and counts every accepted command, so load tests can compare what the app
+sent with what it recorded in its statistics. Run it standalone with:
+
+    python benchmarks/controller_stub.py --port 9100 --latency-ms 50
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REQUIRED_FIELDS = ('username', 'password', 'md5', 'group', 'value')
+
+
+def parse_command(body: str) -> dict:
+    """Parse a controller request body into a dict of fields."""
+    fields = {}
+    for line in body.split('\r\n'):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            fields[key] = value
+    return fields
+
+
+class ControllerStub(ThreadingHTTPServer):
+    """Threaded HTTP server emulating a building controller."""
+
+    daemon_threads = True
+
+    def __init__(self, address, password=None, md5=None, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0):
+        super().__init__(address, _Handler)
+        self.password = password
+        self.md5 = md5
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.commands = Counter()
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "accepted": sum(self.commands.values()),
+                "rejected": self.rejected,
+                "commands": {f"{group}/{value}": count for (group, value), count in self.commands.items()},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.commands.clear()
+            self.rejected = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: ControllerStub
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stub/stats':
+            self._reply(200, self.server.snapshot())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        if self.path == '/stub/stats':
+            self.server.reset()
+            self._reply(200, {"status": "reset"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        fields = parse_command(self.rfile.read(length).decode())
+        stub = self.server
+
+        if self.path != '/iphone/send' or any(field not in fields for field in REQUIRED_FIELDS):
+            with stub.lock:
+                stub.rejected += 1
+            self._reply(400, {"error": "malformed command"})
+            return
+        if (stub.password is not None and fields['password'] != stub.password) or \
+                (stub.md5 is not None and fields['md5'] != stub.md5):
+            with stub.lock:
+                stub.rejected += 1
+            self._reply(403, {"error": "bad credentials"})
+            return
+
+        delay = stub.latency_ms + random.uniform(0, stub.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+
+        if stub.failure_rate and random.random() < stub.failure_rate:
+            with stub.lock:
+                stub.rejected += 1
+            self._reply(503, {"error": "injected failure"})
+            return
+
+        with stub.lock:
+            stub.commands[(fields['group'], fields['value'])] += 1
+        self._reply(200, {"status": "ok"})
+
+
+def start_stub(host='127.0.0.1', port=0, **kwargs) -> ControllerStub:
+    """Start a controller stub on a background thread and return it."""
+    stub = ControllerStub((host, port), **kwargs)
+    threading.Thread(target=stub.serve_forever, name='controller-stub', daemon=True).start()
+    return stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--password', help="reject commands with a different password")
+    parser.add_argument('--md5', help="reject commands with a different md5 value")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="fixed delay per command")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="extra uniform random delay per command")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of commands answered with 503")
+    args = parser.parse_args()
+
+    stub = ControllerStub((args.host, args.port), password=args.password, md5=args.md5,
+                          latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, failure_rate=args.failure_rate)
+    print(f"Controller stub listening on http://{args.host}:{stub.server_address[1]}/iphone/send")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Import-time report for worker boot.
+
+Imports the server module in a fresh interpreter with `-X importtime`, then prints
+the total import time, the slowest top-level packages by cumulative time, the
+resident memory after import and whether the heavy optional modules (pandas,
+msal, cryptography) were loaded on the boot path.
+
+    python benchmarks/import_time.py --top 15 --output import_time.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WATCHED_MODULES = ('pandas', 'numpy', 'msal', 'cryptography')
+
+PROBE = """
+import json, resource, sys
+import server
+print(json.dumps({
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "loaded": {name: name in sys.modules for name in %r},
+}))
+""" % (WATCHED_MODULES,)
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parse `-X importtime` output into (module, self_us, cumulative_us) entries."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append({
+            "module": name[1:].rstrip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    # Import from a scratch directory so the import does not touch the real logs or stores
+    with tempfile.TemporaryDirectory(prefix='curtains-importtime-') as workdir:
+        os.symlink(os.path.join(REPO_ROOT, 'Frontend'), os.path.join(workdir, 'Frontend'))
+        env = {**os.environ, 'PYTHONPATH': REPO_ROOT, 'IS_TEST': os.environ.get('IS_TEST', 'true')}
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                                cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        return result.returncode
+
+    entries = parse_importtime(result.stderr)
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    # Top-level entries (no indentation) add up to the total; their direct children
+    # (one level of indentation) are the packages worth looking at
+    top_level = [entry for entry in entries if not entry["module"].startswith(' ')]
+    children = [entry for entry in entries if entry["module"].startswith('  ') and entry["module"][2] != ' ']
+    total_us = sum(entry["cumulative_us"] for entry in top_level)
+    slowest = sorted(top_level + children, key=lambda entry: entry["cumulative_us"], reverse=True)[:args.top]
+
+    print(f"total import time: {total_us / 1000:.1f} ms, {probe['modules']} modules, "
+          f"max RSS {probe['max_rss_kb'] / 1024:.1f} MB")
+    print(f"\n{'module':<40} {'cumulative':>12} {'self':>10}")
+    for entry in slowest:
+        print(f"{entry['module'].strip():<40} {entry['cumulative_us'] / 1000:>10.1f}ms {entry['self_us'] / 1000:>8.1f}ms")
+    print("\nheavy modules on the boot path:")
+    for name, loaded in probe["loaded"].items():
+        print(f"  {name:<14} {'loaded' if loaded else 'not loaded'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"total_ms": round(total_us / 1000, 3), **probe,
+                       "slowest": slowest}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,369 @@
+"""
+Load test harness for the curtains server.
+
+Starts the app in a scratch working directory (so users.json, chat.json and stats/
+start empty), drives a realistic mix of requests at increasing concurrency and then
+checks that the on-disk stores agree with what the clients observed.
+
+Two modes are supported:
+  test  - the app runs with IS_TEST=true; users sign in through /login/test and
+          curtain commands are simulated by the app itself.
+  stub  - the app runs in production mode against benchmarks/controller_stub.py,
+          sessions are minted with COOKIES_KEY, and every successful /control call
+          must show up both at the stub and in the stats CSVs.
+
+Example:
+    python benchmarks/load_test.py --mode stub --concurrency 1,8,32 --duration 15 --output results.json
+"""
+
+import argparse
+import base64
+import csv
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+from itsdangerous import TimestampSigner
+
+from controller_stub import start_stub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COOKIES_KEY = 'load-test-secret-key'
+
+# Relative weights of the request mix, roughly what a page view plus usage looks like
+DEFAULT_MIX = {
+    'bootstrap': 10,
+    'check_auth': 15,
+    'messages': 15,
+    'control': 25,
+    'stats_all': 5,
+    'chat_poll': 25,
+    'chat_send': 5,
+}
+
+
+def prepare_workdir(rooms_count: int) -> str:
+    """Create a scratch working directory with the static files and a synthetic room catalog."""
+    workdir = tempfile.mkdtemp(prefix='curtains-load-')
+    os.symlink(os.path.join(REPO_ROOT, 'Frontend'), os.path.join(workdir, 'Frontend'))
+    for filename in ('.version', 'whats_new.md'):
+        shutil.copy(os.path.join(REPO_ROOT, filename), workdir)
+
+    rooms = {}
+    for i in range(rooms_count):
+        building = 'ABC'[i % 3]
+        room_name = f"{1 + i // 300}{building}{i % 300:03d}"
+        rooms[room_name] = [{"name": "main", "start": 1000 + i, "stop": 5000 + i}]
+    with open(os.path.join(workdir, 'rooms.json'), 'w') as f:
+        json.dump(rooms, f)
+    return workdir
+
+
+def start_app(workdir: str, env: dict, port: int, workers: int, server: str) -> subprocess.Popen:
+    """Start the app under uvicorn or gunicorn and wait until it answers."""
+    if server == 'gunicorn':
+        cmd = ['gunicorn', 'server:app', '-k', 'uvicorn.workers.UvicornWorker', '-w', str(workers), '--preload',
+               '--bind', f'127.0.0.1:{port}']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(workers), '--log-level', 'warning']
+
+    full_env = {**os.environ, **env, 'PYTHONPATH': REPO_ROOT}
+    process = subprocess.Popen(cmd, cwd=workdir, env=full_env,
+                               stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'server.err'), 'w'))
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early, see {os.path.join(workdir, 'server.err')}")
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/version', timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become ready within 30 seconds")
+
+
+def mint_session_cookie(username: str) -> str:
+    """Build a session cookie the way starlette's SessionMiddleware signs it."""
+    data = base64.b64encode(json.dumps({'user_name': username}).encode())
+    return TimestampSigner(COOKIES_KEY).sign(data).decode()
+
+
+def login(base_url: str, username: str, mode: str) -> requests.Session:
+    session = requests.Session()
+    if mode == 'test':
+        session.get(f'{base_url}/login/test', params={'username': username}, allow_redirects=False)
+    else:
+        session.cookies.set('session', mint_session_cookie(username))
+    return session
+
+
+class VirtualUser(threading.Thread):
+    """A single client issuing requests from the configured mix until the deadline."""
+
+    def __init__(self, base_url, session, username, rooms, mix, seed, deadline):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.session = session
+        self.username = username
+        self.rooms = rooms
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.samples = []
+        self.controlled = Counter()
+        self.skipped = Counter()
+
+    def _request(self, name):
+        if name == 'bootstrap':
+            return self.session.get(f'{self.base_url}/api/bootstrap'), None
+        if name == 'check_auth':
+            return self.session.get(f'{self.base_url}/check-auth'), None
+        if name == 'messages':
+            return self.session.get(f'{self.base_url}/api/messages'), None
+        if name == 'stats_all':
+            return self.session.get(f'{self.base_url}/stats/all'), None
+        if name == 'chat_poll':
+            return self.session.get(f'{self.base_url}/api/chat/messages'), None
+        if name == 'chat_send':
+            return self.session.post(f'{self.base_url}/api/chat/send', json={'message': 'load test'}), None
+        room = self.rng.choice(self.rooms)
+        action = self.rng.choice(('up', 'down', 'stop'))
+        return self.session.get(f'{self.base_url}/control/{room}/{action}'), (room, action)
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            name = self.rng.choices(self.names, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response, command = self._request(name)
+                outcome = 'ok' if response.status_code < 400 else 'limited' if response.status_code == 429 else 'error'
+            except requests.RequestException:
+                command, outcome = None, 'error'
+            self.samples.append((name, time.perf_counter() - start, outcome))
+            if outcome == 'ok' and command:
+                # A repeat of the curtain's current command is not sent (see curtain_state.py)
+                if response.json().get('skipped'):
+                    self.skipped[command] += 1
+                else:
+                    self.controlled[command] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    """Aggregate (name, latency, outcome) samples into throughput and latency percentiles.
+
+    Outcomes are 'ok', 'error', or 'limited' (429 from the rate limiter, counted apart from errors).
+    """
+    by_name = defaultdict(list)
+    outcomes = defaultdict(Counter)
+    for name, latency, outcome in samples:
+        by_name[name].append(latency)
+        outcomes[name][outcome] += 1
+
+    def describe(latencies, counts):
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "errors": counts['error'],
+            "rate_limited": counts['limited'],
+            "throughput_rps": round(len(latencies) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+
+    return {
+        "overall": describe([latency for _, latency, _ in samples], sum(outcomes.values(), Counter())),
+        "endpoints": {name: describe(latencies, outcomes[name]) for name, latencies in sorted(by_name.items())},
+    }
+
+
+def read_stats_totals(workdir: str) -> Counter:
+    """Sum every stats CSV in the workdir into (room, action) counts."""
+    totals = Counter()
+    stats_dir = os.path.join(workdir, 'stats')
+    if not os.path.isdir(stats_dir):
+        return totals
+    for filename in os.listdir(stats_dir):
+        if filename.startswith('stats_') and filename.endswith('.csv'):
+            with open(os.path.join(stats_dir, filename), newline='') as f:
+                for row in csv.DictReader(f):
+                    for action in ('up', 'down', 'stop'):
+                        totals[(row['room_number'], action)] += int(float(row[action] or 0))
+    return totals
+
+
+def check_integrity(workdir, mode, controlled_by_user, skipped, stub):
+    """Compare the on-disk stores with what the clients saw succeed (skipped repeats are not sent)."""
+    problems = []
+    users_path = os.path.join(workdir, 'users.json')
+    try:
+        with open(users_path) as f:
+            stored_users = json.load(f)
+    except (IOError, json.JSONDecodeError) as e:
+        stored_users = {}
+        problems.append(f"users.json unreadable: {e}")
+
+    for username, commands in controlled_by_user.items():
+        expected_rooms = {room for room, _ in commands}
+        stored_rooms = set(stored_users.get(username, {}).get('rooms', []))
+        missing = expected_rooms - stored_rooms
+        if missing:
+            problems.append(f"users.json lost {len(missing)} room(s) for {username}")
+
+    try:
+        with open(os.path.join(workdir, 'chat.json')) as f:
+            chat = json.load(f)
+        if len(chat) > 100:
+            problems.append(f"chat.json holds {len(chat)} messages (limit is 100)")
+    except FileNotFoundError:
+        pass
+    except (IOError, json.JSONDecodeError) as e:
+        problems.append(f"chat.json unreadable: {e}")
+
+    expected = Counter()
+    for commands in controlled_by_user.values():
+        expected.update(commands)
+
+    if mode == 'stub':
+        stored = read_stats_totals(workdir)
+        for key in sorted(set(expected) | set(stored)):
+            if stored[key] != expected[key]:
+                problems.append(f"stats mismatch for {key[0]}/{key[1]}: clients saw {expected[key]}, CSV has {stored[key]}")
+        accepted = stub.snapshot()['accepted']
+        if accepted != sum(expected.values()):
+            problems.append(f"controller accepted {accepted} commands, clients saw {sum(expected.values())} succeed")
+
+    return {"ok": not problems, "problems": problems, "successful_commands": sum(expected.values()),
+            "skipped_commands": sum(skipped.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('test', 'stub'), default='stub')
+    parser.add_argument('--concurrency', default='1,4,16,32', help="comma separated client counts, run in order")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--server', choices=('uvicorn', 'gunicorn'), default='uvicorn')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rooms', type=int, default=60, help="size of the synthetic room catalog")
+    parser.add_argument('--rooms-per-user', type=int, default=3)
+    parser.add_argument('--controller-latency-ms', type=float, default=20.0)
+    parser.add_argument('--controller-jitter-ms', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    workdir = prepare_workdir(args.rooms)
+    with open(os.path.join(workdir, 'rooms.json')) as f:
+        room_names = sorted(json.load(f))
+
+    env = {
+        'COOKIES_KEY': COOKIES_KEY,
+        'USERS_FILE': os.path.join(workdir, 'users.json'),
+        'CHAT_FILE': os.path.join(workdir, 'chat.json'),
+        'REPORTS_FILE': os.path.join(workdir, 'reports', 'reports.txt'),
+        # Every virtual user comes from 127.0.0.1; measure the app, not the rate limiter
+        'RATE_LIMITS': '',
+    }
+    stub = None
+    if args.mode == 'stub':
+        stub = start_stub(password='load-test', md5='load-test',
+                          latency_ms=args.controller_latency_ms, jitter_ms=args.controller_jitter_ms)
+        env.update({
+            'IS_TEST': 'false',
+            'SERVER_IP': '127.0.0.1',
+            'CONTROLLER_SCHEME': 'http',
+            'CURTAINS_USERNAME': 'load',
+            'CURTAINS_PASSWORD': 'load-test',
+            'MD5_VALUE': 'load-test',
+            **{f'SERVER_PORT_{suffix}': str(stub.server_address[1]) for suffix in 'ABC'},
+        })
+    else:
+        env['IS_TEST'] = 'true'
+
+    process = start_app(workdir, env, args.port, args.workers, args.server)
+    base_url = f'http://127.0.0.1:{args.port}'
+    rng = random.Random(args.seed)
+    controlled_by_user = defaultdict(Counter)
+    skipped = Counter()
+    results = {"mode": args.mode, "workers": args.workers, "server": args.server, "levels": []}
+
+    try:
+        for level in levels:
+            deadline = time.perf_counter() + args.duration
+            clients = []
+            for i in range(level):
+                username = f"Load User {level}-{i}"
+                clients.append(VirtualUser(base_url, login(base_url, username, args.mode), username,
+                                           rng.sample(room_names, args.rooms_per_user), DEFAULT_MIX,
+                                           rng.random(), deadline))
+            started = time.perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - started
+
+            samples = [sample for client in clients for sample in client.samples]
+            for client in clients:
+                controlled_by_user[client.username].update(client.controlled)
+                skipped.update(client.skipped)
+            summary = summarize(samples, elapsed)
+            results["levels"].append({"concurrency": level, **summary})
+            overall = summary["overall"]
+            print(f"concurrency={level:<4} requests={overall['requests']:<7} rps={overall['throughput_rps']:<9} "
+                  f"p50={overall['p50_ms']}ms p99={overall['p99_ms']}ms errors={overall['errors']} "
+                  f"rate_limited={overall['rate_limited']}")
+            for name, stats in summary["endpoints"].items():
+                print(f"    {name:<12} n={stats['requests']:<6} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+                      f"errors={stats['errors']} rate_limited={stats['rate_limited']}")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    results["integrity"] = check_integrity(workdir, args.mode, controlled_by_user, skipped, stub)
+    print(f"integrity: {'OK' if results['integrity']['ok'] else 'FAILED'} "
+          f"({results['integrity']['successful_commands']} successful commands, "
+          f"{results['integrity']['skipped_commands']} skipped as repeats)")
+    for problem in results["integrity"]["problems"]:
+        print(f"    {problem}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.keep_workdir:
+        print(f"workdir kept at {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if stub:
+        stub.shutdown()
+    return 0 if results["integrity"]["ok"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Microbenchmarks for the storage hot paths.
+
+Times users._load_users/_save_users against synthetic user stores and
+StatisticsManager.update_stats/get_all_stats/get_total_unique_rooms_count against
+synthetic stats histories, at several data sizes, so the per-request cost can be
+plotted against data size. Results are written as JSON and can be compared with a
+stored baseline:
+
+    python benchmarks/microbench.py --save-baseline benchmarks/baseline.json
+    # ... change something ...
+    python benchmarks/microbench.py --baseline benchmarks/baseline.json --output after.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# The repo's statistics.py shadows the stdlib module, so the repo root must come first
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import users  # noqa: E402
+from statistics import StatisticsManager  # noqa: E402
+
+USER_SIZES = (100, 10_000, 100_000)
+DAY_SIZES = (30, 365, 1000)
+QUICK_USER_SIZES = (100, 1_000)
+QUICK_DAY_SIZES = (30, 90)
+ROOMS_PER_DAY = 40
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def measure(func, min_runs=3, max_runs=50, min_time=0.5):
+    """Run func repeatedly and return timing statistics in milliseconds."""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (len(timings) < min_runs or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": len(timings),
+        "min_ms": round(min(timings), 4),
+        "median_ms": round(_median(timings), 4),
+        "max_ms": round(max(timings), 4),
+    }
+
+
+def make_users(count: int, rng: random.Random) -> dict:
+    """Build a users store shaped like production data."""
+    return {
+        f"User {i:06d}": {
+            "is_premium": rng.random() < 0.1,
+            "rooms": [f"{rng.randint(1, 9)}{rng.choice('ABC')}{rng.randint(0, 999):03d}"
+                      for _ in range(rng.randint(0, 4))],
+            "messages": [],
+            "points": rng.choice((0, 0, 0, 20, 40, 60)),
+        }
+        for i in range(count)
+    }
+
+
+def make_stats_history(stats_dir: str, days: int, rng: random.Random):
+    """Write one stats CSV per day, ending today, in the StatisticsManager format."""
+    room_pool = [f"{floor}{building}{number:03d}" for floor in range(1, 10) for building in 'ABC'
+                 for number in range(0, 300, 7)]
+    today = date.today()
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        with open(os.path.join(stats_dir, f"stats_{day.isoformat()}.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['room_number', 'up', 'down', 'stop'])
+            for room in rng.sample(room_pool, ROOMS_PER_DAY):
+                writer.writerow([room, rng.randint(0, 20), rng.randint(0, 20), rng.randint(0, 5)])
+
+
+def bench_users(sizes, workdir, rng):
+    results = []
+    for size in sizes:
+        users.USERS_FILE = os.path.join(workdir, f"users_{size}.json")
+        store = make_users(size, rng)
+        users._save_users(store)
+        file_size = os.path.getsize(users.USERS_FILE)
+
+        for name, func in (("users._load_users", users._load_users),
+                           ("users._save_users", lambda: users._save_users(store))):
+            results.append({"name": name, "size": size, "unit": "users", "file_bytes": file_size, **measure(func)})
+            print(f"{name:<48} users={size:<8} median={results[-1]['median_ms']:.3f}ms")
+    return results
+
+
+def bench_stats(sizes, workdir, rng):
+    results = []
+    for size in sizes:
+        stats_dir = os.path.join(workdir, f"stats_{size}")
+        os.makedirs(stats_dir)
+        make_stats_history(stats_dir, size, rng)
+        manager = StatisticsManager(stats_dir=stats_dir)
+        rooms = [f"1A{number:03d}" for number in range(ROOMS_PER_DAY)]
+
+        benchmarks = (
+            ("StatisticsManager.update_stats",
+             lambda: manager.update_stats(rng.choice(rooms), rng.choice(('up', 'down', 'stop')))),
+            ("StatisticsManager.get_all_stats", manager.get_all_stats),
+            ("StatisticsManager.get_total_unique_rooms_count", manager.get_total_unique_rooms_count),
+        )
+        for name, func in benchmarks:
+            results.append({"name": name, "size": size, "unit": "days", **measure(func)})
+            print(f"{name:<48} days={size:<9} median={results[-1]['median_ms']:.3f}ms")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline and return the list of regressions."""
+    previous = {(entry["name"], entry["size"]): entry for entry in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'benchmark':<48} {'size':>8} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for entry in results:
+        before = previous.get((entry["name"], entry["size"]))
+        if not before:
+            continue
+        ratio = entry["median_ms"] / before["median_ms"] if before["median_ms"] else float('inf')
+        entry["baseline_median_ms"] = before["median_ms"]
+        entry["ratio"] = round(ratio, 3)
+        flag = ' REGRESSION' if ratio > tolerance else ''
+        print(f"{entry['name']:<48} {entry['size']:>8} {before['median_ms']:>10.3f}ms "
+              f"{entry['median_ms']:>10.3f}ms {ratio:>6.2f}x{flag}")
+        if ratio > tolerance:
+            regressions.append(entry)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help="small data sizes only, for a fast sanity run")
+    parser.add_argument('--only', choices=('users', 'stats'), help="run only one group of benchmarks")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against a results file saved earlier")
+    parser.add_argument('--save-baseline', help="write results to this file as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="flag benchmarks slower than baseline by more than this factor")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='curtains-microbench-')
+    results = []
+    try:
+        if args.only in (None, 'users'):
+            results += bench_users(QUICK_USER_SIZES if args.quick else USER_SIZES, workdir, rng)
+        if args.only in (None, 'stats'):
+            results += bench_stats(QUICK_DAY_SIZES if args.quick else DAY_SIZES, workdir, rng)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["regressions"] = len(regressions)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Circuit module - health tracking and circuit breaking per building controller.
+
+Each building (A, B, C) has its own breaker. After CONTROLLER_FAILURE_THRESHOLD
+consecutive failures (connection errors, timeouts or 5xx answers) the breaker opens
+and calls for that building fail fast for CONTROLLER_RESET_TIMEOUT seconds. Then a
+single probe call is let through (half-open): success closes the breaker, failure
+opens it again. A dead controller therefore costs one timeout per reset period
+instead of one per request, and never blocks the other buildings.
+
+Breakers live in worker memory, so every worker learns a controller's health on its own.
+"""
+
+import threading
+import time
+
+from config import CONTROLLER_FAILURE_THRESHOLD, CONTROLLER_RESET_TIMEOUT
+from utils import after_fork
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Failure counter and state machine for a single controller."""
+
+    def __init__(self, name: str, failure_threshold: int = CONTROLLER_FAILURE_THRESHOLD,
+                 reset_timeout: float = CONTROLLER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_error = None
+        self.last_failure = None
+        self.last_success = None
+        self.latency_ms = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check whether a call may go out now; in half-open state only one probe at a time."""
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self) -> int:
+        """Seconds until the next probe may be attempted."""
+        if self.opened_at is None:
+            return 0
+        return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self, latency_ms: float):
+        with self.lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+            self.successes += 1
+            self.last_success = time.time()
+            # Exponentially weighted, so the figure follows the controller's current speed
+            self.latency_ms = latency_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * latency_ms
+
+    def record_failure(self, error: str):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.failures += 1
+            self.last_error = error
+            self.last_failure = time.time()
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            state = self.state
+            if state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                state = HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "last_failure": self.last_failure,
+                "last_success": self.last_success,
+                "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                "retry_after": self.retry_after() if state == OPEN else 0,
+            }
+
+
+BUILDINGS = ('A', 'B', 'C')
+_breakers = {building: CircuitBreaker(building) for building in BUILDINGS}
+
+
+@after_fork
+def _reset_breakers():
+    global _breakers
+    _breakers = {building: CircuitBreaker(building) for building in BUILDINGS}
+
+
+def get_breaker(building: str) -> CircuitBreaker:
+    return _breakers[building]
+
+
+def get_controllers_health() -> dict:
+    """Breaker state of every building controller, as seen by this worker."""
+    return {building: breaker.to_dict() for building, breaker in _breakers.items()}
@@ -0,0 +1,181 @@
+"""
+Compression module - negotiated gzip/brotli compression of responses.
+
+Responses are compressed with brotli when the client accepts it and the brotli
+package is installed, otherwise with gzip. Bodies smaller than COMPRESSION_MIN_SIZE
+are sent as they are, since compressing them costs more time than it saves bytes.
+Responses that already have a Content-Encoding (the precompressed frontend assets),
+are not text-like, or are server-sent events pass through untouched.
+
+A compressed response gets a weak ETag, since its bytes differ from the identity
+representation; documents.is_not_modified accepts both forms.
+"""
+
+import zlib
+
+from config import COMPRESSION_BROTLI_QUALITY, COMPRESSION_GZIP_LEVEL, COMPRESSION_MIN_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/x-ndjson', 'image/svg+xml')
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Map each coding of an Accept-Encoding header to its quality value."""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        codings[coding.strip().lower()] = quality
+    return codings
+
+
+def choose_encoding(header: str, supported=None):
+    """
+    The best encoding for an Accept-Encoding header, or None.
+
+    supported lists the candidates in order of preference (ties go to the first);
+    by default the encodings this module can compress with.
+    """
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    if supported is None:
+        supported = ('br', 'gzip') if brotli is not None else ('gzip',)
+    best, best_quality = None, 0.0
+    for coding in supported:
+        quality = codings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith('text/event-stream')
+
+
+class _Compressor:
+    """Incremental compressor for one response."""
+
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            # wbits 16+ makes zlib write a gzip header and trailer
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        if self._brotli is not None:
+            output = self._brotli.process(data)
+            return output + (self._brotli.flush() if more else self._brotli.finish())
+        output = self._zlib.compress(data)
+        # Flush each streamed chunk so the client is not kept waiting for it
+        return output + self._zlib.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing text-like responses above the size threshold."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ''
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+                break
+        encoding = choose_encoding(accept_encoding)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message['type'] == 'http.response.start':
+                headers = {name.lower(): value for name, value in message.get('headers', [])}
+                content_type = headers.get(b'content-type', b'').decode('latin-1')
+                if (b'content-encoding' in headers or message['status'] in (204, 304)
+                        or not _is_compressible(content_type)):
+                    passthrough = True
+                    await send(message)
+                    return
+                _add_vary(message)
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                # Wait for the first body chunk to know whether compressing pays off
+                start = message
+                return
+
+            if message['type'] != 'http.response.body' or start is None:
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more = message.get('more_body', False)
+            if compressor is None:
+                if not more and len(body) < COMPRESSION_MIN_SIZE:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                compressed = compressor.compress(body, more)
+                _set_encoding(start, encoding, None if more else len(compressed))
+                await send(start)
+                await send({'type': 'http.response.body', 'body': compressed, 'more_body': more})
+                return
+
+            await send({'type': 'http.response.body', 'body': compressor.compress(body, more), 'more_body': more})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _add_vary(message):
+    headers = message.setdefault('headers', [])
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == b'vary':
+            if b'accept-encoding' not in value.lower():
+                headers[index] = (name, value + b', Accept-Encoding')
+            return
+    headers.append((b'vary', b'Accept-Encoding'))
+
+
+def _set_encoding(message, encoding: str, length):
+    """Mark the start message as compressed; length is None for a streamed body."""
+    headers = []
+    for name, value in message['headers']:
+        lowered = name.lower()
+        if lowered == b'content-length':
+            continue
+        if lowered == b'etag' and value.startswith(b'"'):
+            value = b'W/' + value
+        headers.append((name, value))
+    headers.append((b'content-encoding', encoding.encode('latin-1')))
+    if length is not None:
+        headers.append((b'content-length', str(length).encode('latin-1')))
+    message['headers'] = headers
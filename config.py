@@ -31,11 +31,85 @@ else:
     COOKIES_KEY = os.getenv('COOKIES_KEY')
 
 # Admin users (parsed from comma-separated list, stored lowercase for case-insensitive comparison)
-ADMIN_USERS = [user.strip().lower() for user in os.getenv('ADMIN_USERS', 'developer').split(',') if user.strip()]
+ADMIN_USERS = frozenset(user.strip().lower() for user in os.getenv('ADMIN_USERS', 'developer').split(',') if user.strip())
+
+# Sessions: 'cookie' keeps everything in the signed cookie, 'server' also tracks session ids
+# in SESSIONS_FILE so they can be revoked. Premium flags and points are cached for PRINCIPAL_CACHE_TTL seconds.
+SESSION_STORE = os.getenv('SESSION_STORE', 'cookie').lower()
+SESSIONS_FILE = os.getenv('SESSIONS_FILE', 'sessions.json')
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', '30'))
+
+# The building controllers speak HTTPS; benchmarks point this at a plain HTTP stub
+CONTROLLER_SCHEME = os.getenv('CONTROLLER_SCHEME', 'https')
+
+# Controller calls: (connect, read) timeouts in seconds, circuit breaker per building
+# and bounded retries for idempotent stop commands (see circuit.py)
+CONTROLLER_CONNECT_TIMEOUT = float(os.getenv('CONTROLLER_CONNECT_TIMEOUT', '3'))
+CONTROLLER_READ_TIMEOUT = float(os.getenv('CONTROLLER_READ_TIMEOUT', '10'))
+CONTROLLER_FAILURE_THRESHOLD = int(os.getenv('CONTROLLER_FAILURE_THRESHOLD', '5'))
+CONTROLLER_RESET_TIMEOUT = float(os.getenv('CONTROLLER_RESET_TIMEOUT', '30'))
+CONTROLLER_STOP_RETRIES = int(os.getenv('CONTROLLER_STOP_RETRIES', '2'))
+CONTROLLER_RETRY_BACKOFF = float(os.getenv('CONTROLLER_RETRY_BACKOFF', '0.2'))
+
+# SQLite database for state shared by all workers (see db.py)
+DB_FILE = os.getenv('DB_FILE', 'curtains.db')
+
+# Seconds after an up/down during which the same command for that curtain is not sent again
+CURTAIN_STATE_TTL = float(os.getenv('CURTAIN_STATE_TTL', '20'))
+
+# Asynchronous control (opt-in, see jobs.py): /control queues the command and returns a job id
+ASYNC_CONTROL = os.getenv('ASYNC_CONTROL', 'false').lower() == 'true'
+JOB_DISPATCHERS = int(os.getenv('JOB_DISPATCHERS', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+JOB_STALE_TIMEOUT = float(os.getenv('JOB_STALE_TIMEOUT', '120'))
+JOB_RETENTION = float(os.getenv('JOB_RETENTION', '86400'))
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', '25'))
+
+# Token-bucket rate limits per route as name=capacity/seconds (see ratelimit.py), off by default.
+# Buckets are per user (and room); add name.ip=capacity/seconds to also limit per client IP
+RATE_LIMITS = os.getenv('RATE_LIMITS', '')
+
+# Reports are buffered and written in batches, rotated by size (see reports.py)
+REPORTS_BATCH_SIZE = int(os.getenv('REPORTS_BATCH_SIZE', '50'))
+REPORTS_FLUSH_INTERVAL = float(os.getenv('REPORTS_FLUSH_INTERVAL', '1'))
+REPORTS_MAX_BYTES = int(os.getenv('REPORTS_MAX_BYTES', str(5 * 1024 * 1024)))
+REPORTS_BACKUP_COUNT = int(os.getenv('REPORTS_BACKUP_COUNT', '5'))
+
+# Scheduled curtain commands (see schedules.py); one worker holds the scheduler lease
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_LEASE_TTL = float(os.getenv('SCHEDULER_LEASE_TTL', '15'))
+SCHEDULER_CONCURRENCY = int(os.getenv('SCHEDULER_CONCURRENCY', '2'))
+SCHEDULE_MISFIRE_GRACE = float(os.getenv('SCHEDULE_MISFIRE_GRACE', '300'))
+SCHEDULES_PER_USER = int(os.getenv('SCHEDULES_PER_USER', '20'))
+
+# Point-in-time snapshots of all stores (see snapshots.py); the newest SNAPSHOT_KEEP are kept
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_KEEP = int(os.getenv('SNAPSHOT_KEEP', '14'))
+
+# Seconds a stopping worker waits for in-flight control commands before flushing and exiting (see lifecycle.py)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+
+# Response compression (see compression.py); bodies smaller than COMPRESSION_MIN_SIZE are sent as they are
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+
+# Fingerprinted static assets produced by `python assets.py`; served instead of Frontend/ when present
+ASSETS_BUILD_DIR = os.getenv('ASSETS_BUILD_DIR', 'build/Frontend')
 
 STATISTICS_FOLDER = "csv/"
+# Hour-of-week and week-of-year usage buckets per room (see analytics.py)
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', 'stats')
 CSV_FORMAT = "Room,Up,Down"
 
+# Slow-request profiling (opt-in, see profiling.py)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_THRESHOLD_MS = float(os.getenv('PROFILING_THRESHOLD_MS', '500'))
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILING_SAMPLE_INTERVAL_MS', '10'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', 'profiles')
+PROFILING_RING_SIZE = int(os.getenv('PROFILING_RING_SIZE', '100'))
+
 
 def get_server_port(suffix):
     return os.getenv('SERVER_PORT_' + suffix)
@@ -0,0 +1,80 @@
+"""
+Curtain state module - last commanded state of every curtain.
+
+Each successful command records the room, curtain direction, action and time in the
+shared database. An up or down repeating the last command of the same curtain within
+CURTAIN_STATE_TTL seconds is redundant (the curtain is already moving that way), so
+it is acknowledged without contacting the controller. Stop is always sent.
+
+The check and the record happen in one transaction, so of a burst of identical
+clicks across all workers only the first reaches the controller.
+"""
+
+import logging
+import sqlite3
+import time
+from typing import Optional
+
+from config import CURTAIN_STATE_TTL
+from db import get_connection, register_schema, transaction
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS curtain_state (
+    room TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    action TEXT NOT NULL,
+    username TEXT,
+    commanded_at REAL NOT NULL,
+    PRIMARY KEY (room, direction)
+) WITHOUT ROWID;
+""")
+
+
+def claim(room: str, direction: Optional[str], action: str, username: Optional[str] = None) -> bool:
+    """
+    Record a command about to be sent. Returns False if it repeats the curtain's
+    last command within CURTAIN_STATE_TTL and should not be sent.
+    """
+    direction = direction or ''
+    now = time.time()
+    try:
+        with transaction() as connection:
+            if action != 'stop':
+                row = connection.execute(
+                    "SELECT action, commanded_at FROM curtain_state WHERE room = ? AND direction = ?",
+                    (room, direction)).fetchone()
+                if row and row['action'] == action and now - row['commanded_at'] < CURTAIN_STATE_TTL:
+                    return False
+            connection.execute(
+                "INSERT OR REPLACE INTO curtain_state (room, direction, action, username, commanded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (room, direction, action, username, now))
+    except sqlite3.Error as e:
+        # Never block a command because the state store is unavailable
+        logging.error(f"Failed to record curtain state for room {room}: {e}")
+    return True
+
+
+def forget(room: str, direction: Optional[str]):
+    """Drop a curtain's state after a failed command, since its position is unknown."""
+    try:
+        with transaction() as connection:
+            connection.execute("DELETE FROM curtain_state WHERE room = ? AND direction = ?", (room, direction or ''))
+    except sqlite3.Error as e:
+        logging.error(f"Failed to clear curtain state for room {room}: {e}")
+
+
+def get_room_state(room: str) -> list:
+    """Last commanded state of each curtain in a room."""
+    now = time.time()
+    rows = get_connection().execute(
+        "SELECT direction, action, commanded_at FROM curtain_state WHERE room = ? ORDER BY direction",
+        (room,)).fetchall()
+    return [{
+        "direction": row['direction'] or None,
+        "action": row['action'],
+        "commanded_at": row['commanded_at'],
+        "age": round(now - row['commanded_at'], 1),
+        # Within the TTL the curtain may still be moving
+        "moving": row['action'] != 'stop' and now - row['commanded_at'] < CURTAIN_STATE_TTL,
+    } for row in rows]
@@ -0,0 +1,60 @@
+"""
+DB module - the SQLite database shared by all workers.
+
+JSON files work for data that one request at a time touches, but state that every
+worker must agree on (queued jobs, rate limits, ...) lives in DB_FILE. Each thread
+gets its own connection in WAL mode, so readers never wait for the writer and
+writers queue up on the database lock for up to busy_timeout.
+
+Modules declare their tables with register_schema(); the statements run on every
+new connection, so they must be idempotent (CREATE ... IF NOT EXISTS).
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DB_FILE
+
+BUSY_TIMEOUT_MS = 5000
+
+_schemas = []
+_local = threading.local()
+
+
+def register_schema(sql: str):
+    """Register CREATE statements to run on every connection."""
+    _schemas.append(sql)
+
+
+def get_connection() -> sqlite3.Connection:
+    """Get this thread's connection, creating it (and the schema) on first use."""
+    connection = getattr(_local, 'connection', None)
+    # A connection inherited from the preloading master must not be used in a worker
+    if connection is None or _local.pid != os.getpid():
+        connection = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        _local.connection = connection
+        _local.pid = os.getpid()
+        _local.schemas = 0
+    if _local.schemas < len(_schemas):
+        for sql in _schemas[_local.schemas:]:
+            connection.executescript(sql)
+        _local.schemas = len(_schemas)
+    return connection
+
+
+@contextmanager
+def transaction():
+    """Run a block in a write transaction, taking the database lock up front."""
+    connection = get_connection()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
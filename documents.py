@@ -0,0 +1,173 @@
+"""
+Documents module - small on-disk documents (.version, whats_new.md) cached in memory.
+
+Each document is re-read only when its mtime changes, so a request costs one stat().
+Responses carry ETag/Last-Modified and conditional requests are answered with 304.
+Each representation of a document (e.g. markdown and rendered HTML) has its own ETag.
+"""
+
+import hashlib
+import html
+import os
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import markdown as markdown_lib
+except ImportError:
+    markdown_lib = None
+
+
+class CachedDocument:
+    """In-memory copy of a text file, plus lazily derived renderings of it."""
+
+    def __init__(self, content: str, mtime: float, size: int):
+        self.content = content
+        self.mtime = mtime
+        self.size = size
+        self.etag = f'"{hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.derived = {}
+
+    def derive(self, name: str, func):
+        """Return func(content), computed once per version of the document."""
+        if name not in self.derived:
+            self.derived[name] = func(self.content)
+        return self.derived[name]
+
+
+_documents = {}
+_lock = threading.Lock()
+
+
+def get_document(path: str) -> Optional[CachedDocument]:
+    """Get a document from the cache, re-reading it if it changed on disk. None if missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _documents.pop(path, None)
+        return None
+
+    document = _documents.get(path)
+    if document is not None and document.mtime == stat.st_mtime and document.size == stat.st_size:
+        return document
+
+    with _lock:
+        with open(path, 'r', encoding='utf-8') as f:
+            document = CachedDocument(f.read(), stat.st_mtime, stat.st_size)
+        _documents[path] = document
+    return document
+
+
+def representation_etag(document, variant: Optional[str] = None) -> str:
+    """The document's ETag, suffixed with the variant for a derived representation."""
+    return f'{document.etag[:-1]}-{variant}"' if variant else document.etag
+
+
+def is_not_modified(request: Request, document: CachedDocument, variant: Optional[str] = None) -> bool:
+    """Check the request's conditional headers against a document (or one variant of it)."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # Weak comparison: a compressed response carries the weak form of the ETag
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return representation_etag(document, variant) in tags or '*' in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(document.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(request: Request, document: CachedDocument, build_response,
+                         variant: Optional[str] = None) -> Response:
+    """
+    Return 304 for a matching conditional request, otherwise build_response() with validators.
+
+    variant names a derived representation (e.g. 'html'), so it gets an ETag of its own.
+    """
+    headers = {
+        'ETag': representation_etag(document, variant),
+        'Last-Modified': document.last_modified,
+        'Cache-Control': 'no-cache',
+    }
+    if is_not_modified(request, document, variant):
+        return Response(status_code=304, headers=headers)
+
+    response = build_response()
+    response.headers.update(headers)
+    return response
+
+
+def _render_inline(text: str) -> str:
+    text = html.escape(text, quote=False)
+    text = re.sub(r'`([^`]+)`', r'<code>\1</code>', text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
+    text = re.sub(r'(?<!\*)\*([^*]+)\*(?!\*)', r'<em>\1</em>', text)
+    text = re.sub(r'\[([^\]]+)\]\(([^)\s]+)\)', r'<a href="\2">\1</a>', text)
+    return text
+
+
+def _render_markdown_basic(text: str) -> str:
+    """Render the markdown subset used by whats_new.md: headings, nested lists, paragraphs."""
+    output = []
+    list_depths = []
+    paragraph = []
+
+    def close_paragraph():
+        if paragraph:
+            output.append(f"<p>{_render_inline(' '.join(paragraph))}</p>")
+            paragraph.clear()
+
+    def close_lists(depth=-1):
+        while list_depths and list_depths[-1] > depth:
+            output.append('</li></ul>')
+            list_depths.pop()
+
+    for line in text.splitlines():
+        heading = re.match(r'^(#{1,6})\s+(.*)$', line)
+        item = re.match(r'^(\s*)[-*+]\s+(.*)$', line)
+        if heading:
+            close_paragraph()
+            close_lists()
+            level = len(heading.group(1))
+            output.append(f"<h{level}>{_render_inline(heading.group(2).strip())}</h{level}>")
+        elif item:
+            close_paragraph()
+            depth = len(item.group(1).expandtabs(4)) // 2
+            if list_depths and list_depths[-1] == depth:
+                output.append('</li>')
+            elif list_depths and list_depths[-1] > depth:
+                close_lists(depth)
+                if list_depths and list_depths[-1] == depth:
+                    output.append('</li>')
+            if not list_depths or list_depths[-1] < depth:
+                output.append('<ul>')
+                list_depths.append(depth)
+            output.append(f"<li>{_render_inline(item.group(2).strip())}")
+        elif not line.strip():
+            close_paragraph()
+            close_lists()
+        else:
+            if list_depths:
+                output[-1] += ' ' + _render_inline(line.strip())
+            else:
+                paragraph.append(line.strip())
+
+    close_paragraph()
+    close_lists()
+    return '\n'.join(output)
+
+
+def render_markdown(text: str) -> str:
+    """Render markdown to HTML, using the markdown package when it is installed."""
+    if markdown_lib is not None:
+        return markdown_lib.markdown(text)
+    return _render_markdown_basic(text)
@@ -1,11 +1,29 @@
 import json
 import logging
-from functools import lru_cache
+import os
+import random
+import time
 
 import requests
 from fastapi import HTTPException
 
-from config import CURTAINS_USERNAME, MD5_VALUE
+from circuit import get_breaker
+from config import CONTROLLER_CONNECT_TIMEOUT, CONTROLLER_READ_TIMEOUT, CONTROLLER_RETRY_BACKOFF, CONTROLLER_SCHEME, \
+    CURTAINS_USERNAME, MD5_VALUE
+from profiling import phase
+from utils import after_fork
+
+# Connection pool for controller calls; sockets must not be shared between forked workers
+_controller_session = requests.Session()
+
+ROOMS_FILE = 'rooms.json'
+_rooms = {"key": None, "data": {}}
+
+
+@after_fork
+def _reset_controller_session():
+    global _controller_session
+    _controller_session = requests.Session()
 
 
 def get_suffix(room_name):
@@ -19,7 +37,7 @@ def get_suffix(room_name):
 def get_username(room_name):
     suffix = get_suffix(room_name)
     username = CURTAINS_USERNAME + suffix
-    logging.info(f'username is {username}')
+    logging.debug(f'username is {username}')
 
     return username
 
@@ -36,23 +54,80 @@ def get_states_by_direction(room_name, direction):
     return states[0]
 
 
-@lru_cache(maxsize=None)
 def load_rooms_data():
+    """The room catalog, re-read only when rooms.json changes on disk."""
     try:
-        with open('rooms.json', 'r', encoding='utf-8') as file:
-            return json.load(file)
-    except Exception as e:
+        stat = os.stat(ROOMS_FILE)
+    except FileNotFoundError as e:
         logging.error(f"Error loading rooms.json: {e}")
-        return {}
-
-
-def send_message(group, command, creds, address):
-    url = f"https://{address[0]}:{address[1]}/iphone/send"
+        return _rooms["data"]
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if key != _rooms["key"]:
+        try:
+            with open(ROOMS_FILE, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except Exception as e:
+            # Keep serving the last good catalog until the file changes again
+            logging.error(f"Error loading rooms.json: {e}")
+            _rooms["key"] = key
+            return _rooms["data"]
+        if _rooms["key"] is not None:
+            logging.info(f"Reloaded rooms.json ({len(data)} rooms)")
+        _rooms.update(key=key, data=data)
+    return _rooms["data"]
+
+
+def send_message(group, command, creds, address, building=None, retries=0):
+    """
+    Post a command to a building controller.
+
+    With a building, the call goes through that building's circuit breaker: an open
+    breaker fails fast with 503. retries is only safe for idempotent commands (stop);
+    retries back off exponentially with full jitter.
+    """
+    url = f"{CONTROLLER_SCHEME}://{address[0]}:{address[1]}/iphone/send"
     data = f"username={creds[0]}\r\npassword={creds[1]}\r\nsk=\r\nversion=2\r\nmd5={MD5_VALUE}\r\ngroup={group}\r\neis=1.001\r\nvalue={command}\r\n"
-    logging.info(f'Posting to: {url} with data: {data}')
-
-    res = requests.post(url, data=data, headers={'User-Agent': 'XXter/1.0'}, verify=False)
-    return res
+    breaker = get_breaker(building) if building else None
+    res = None
+    timed_out = False
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(random.uniform(0, CONTROLLER_RETRY_BACKOFF * 2 ** attempt))
+        if breaker and not breaker.allow():
+            if attempt:
+                break
+            raise HTTPException(status_code=503, detail=f"Controller for building {building} is unavailable, try again later",
+                                headers={"Retry-After": str(breaker.retry_after())})
+
+        # Never log the body, it carries the controller password
+        logging.info(f'Posting to: {url} group={group} value={command}')
+        start = time.perf_counter()
+        try:
+            with phase('controller_call'):
+                res = _controller_session.post(url, data=data, headers={'User-Agent': 'XXter/1.0'}, verify=False,
+                                               timeout=(CONTROLLER_CONNECT_TIMEOUT, CONTROLLER_READ_TIMEOUT))
+        except requests.RequestException as e:
+            timed_out = isinstance(e, requests.Timeout)
+            error = f"{type(e).__name__}: {e}"
+        except Exception as e:
+            if breaker:
+                breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        else:
+            if res.status_code < 500:
+                if breaker:
+                    breaker.record_success((time.perf_counter() - start) * 1000)
+                return res
+            error = f"HTTP {res.status_code}"
+
+        if breaker:
+            breaker.record_failure(error)
+        logging.warning(f"Controller call for building {building} failed (attempt {attempt + 1}/{retries + 1}): {error}")
+
+    if res is not None:
+        return res
+    raise HTTPException(status_code=504 if timed_out else 502, detail=f"Controller for building {building} did not respond")
 
 
 def get_room_states(room_name: str):
@@ -0,0 +1,150 @@
+"""
+Jobs module - durable queue of curtain commands for asynchronous control.
+
+With ASYNC_CONTROL enabled, /control stores the command as a job in the shared
+database and replies with its id right away. Dispatcher threads in every worker
+claim queued jobs one at a time and run them against the controllers, so a burst
+of commands is worked off at the dispatchers' pace while the web threads stay free.
+Clients follow a job through /api/jobs/{id}, optionally long-polling until it ends.
+
+Queued jobs survive restarts. A job left running by a worker that died is failed
+after JOB_STALE_TIMEOUT rather than replayed, since a late up/down could undo a
+newer command.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Optional
+
+from fastapi import HTTPException
+
+from config import JOB_DISPATCHERS, JOB_POLL_INTERVAL, JOB_RETENTION, JOB_STALE_TIMEOUT
+from db import get_connection, register_schema, transaction
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+# How often a long-polling /api/jobs request re-reads its job
+WAIT_POLL_INTERVAL = 0.2
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    username TEXT,
+    room TEXT NOT NULL,
+    action TEXT NOT NULL,
+    direction TEXT,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    status_code INTEGER,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+""")
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+
+
+def enqueue(username: Optional[str], room: str, action: str, direction: Optional[str]) -> dict:
+    """Queue a curtain command and return the new job."""
+    job_id = uuid.uuid4().hex
+    with transaction() as connection:
+        connection.execute(
+            "INSERT INTO jobs (id, username, room, action, direction, status, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, username, room, action, direction, QUEUED, time.time()))
+    # Dispatchers in this worker start at once; the others notice on their next poll
+    _wakeup.set()
+    return get_job(job_id)
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    row = get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _claim() -> Optional[dict]:
+    """Take the oldest queued job, atomically across workers."""
+    with transaction() as connection:
+        row = connection.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+        if row is None:
+            return None
+        started = time.time()
+        connection.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, started, row['id']))
+    return {**dict(row), 'status': RUNNING, 'started': started}
+
+
+def _finish(job_id: str, status: str, status_code: int, message: str):
+    with transaction() as connection:
+        connection.execute(
+            "UPDATE jobs SET status = ?, finished = ?, status_code = ?, message = ? WHERE id = ?",
+            (status, time.time(), status_code, message, job_id))
+
+
+def _expire():
+    """Fail jobs abandoned by a dead worker and drop finished jobs past retention."""
+    now = time.time()
+    with transaction() as connection:
+        stale = connection.execute(
+            "UPDATE jobs SET status = ?, finished = ?, status_code = 500, message = ? WHERE status = ? AND started < ?",
+            (FAILED, now, "The command was interrupted, please try again", RUNNING, now - JOB_STALE_TIMEOUT)).rowcount
+        connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                           FINISHED_STATUSES + (now - JOB_RETENTION,))
+    if stale:
+        logging.warning(f"Failed {stale} stale jobs")
+
+
+def _run_job(job: dict, handler):
+    try:
+        message = handler(job)
+        _finish(job['id'], SUCCEEDED, 200, message)
+    except HTTPException as e:
+        _finish(job['id'], FAILED, e.status_code, str(e.detail))
+    except Exception as e:
+        logging.error(f"Job {job['id']} ({job['room']} {job['action']}) failed: {e}")
+        _finish(job['id'], FAILED, 500, "Failed to send command")
+
+
+def _dispatch(handler):
+    last_expire = 0
+    while not _stop.is_set():
+        try:
+            if time.monotonic() - last_expire >= 60:
+                _expire()
+                last_expire = time.monotonic()
+            job = _claim()
+        except Exception as e:
+            logging.error(f"Job dispatcher failed to read the queue: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        _run_job(job, handler)
+
+
+def start_dispatchers(handler):
+    """Start this worker's dispatcher threads; handler(job) runs a job and returns its message."""
+    _stop.clear()
+    for index in range(JOB_DISPATCHERS):
+        thread = threading.Thread(target=_dispatch, args=(handler,), name=f'job-dispatcher-{index}', daemon=True)
+        thread.start()
+        _threads.append(thread)
+    logging.info(f"Started {JOB_DISPATCHERS} job dispatchers")
+
+
+def stop_dispatchers(timeout: float = 5.0):
+    """Let the dispatchers finish their current job and stop."""
+    _stop.set()
+    _wakeup.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
@@ -0,0 +1,141 @@
+"""
+Lifecycle module - readiness, draining and orderly shutdown of a worker.
+
+On SIGTERM (sent by gunicorn on a restart or reload) a worker starts draining:
+it reports not ready, refuses new control commands with 503 + Retry-After, and
+runs the on_drain callbacks (stop the scheduler and the job dispatchers) in a
+background thread. Uvicorn meanwhile finishes the requests in flight. At the
+lifespan shutdown, shutdown() waits up to DRAIN_TIMEOUT seconds for the control
+commands still in flight (from requests, jobs or schedules) and then runs the
+on_flush callbacks (buffered reports etc.), so nothing buffered is lost.
+"""
+
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from config import DRAIN_TIMEOUT
+from utils import after_fork
+
+_drain_callbacks = []
+_flush_callbacks = []
+_state = {"started": None, "draining": False, "inflight": 0}
+_condition = threading.Condition()
+_drain_thread = None
+
+
+@after_fork
+def _reset():
+    global _condition, _drain_thread
+    _state.update(started=None, draining=False, inflight=0)
+    _condition = threading.Condition()
+    _drain_thread = None
+
+
+def on_drain(func):
+    """Register func to run when draining starts, to stop taking new work."""
+    _drain_callbacks.append(func)
+    return func
+
+
+def on_flush(func):
+    """Register func to run at shutdown, after in-flight commands finished, to persist buffered state."""
+    _flush_callbacks.append(func)
+    return func
+
+
+def mark_started():
+    _state["started"] = time.time()
+
+
+def is_ready() -> bool:
+    return _state["started"] is not None and not _state["draining"]
+
+
+def is_draining() -> bool:
+    return _state["draining"]
+
+
+def check_accepting():
+    """Refuse new commands while draining, so the client retries on a fresh worker."""
+    if _state["draining"]:
+        raise HTTPException(status_code=503, detail="Server is restarting, please try again",
+                            headers={"Retry-After": "1"})
+
+
+@contextmanager
+def inflight():
+    """Count a command as in flight until the block ends; shutdown waits for it."""
+    with _condition:
+        _state["inflight"] += 1
+    try:
+        yield
+    finally:
+        with _condition:
+            _state["inflight"] -= 1
+            _condition.notify_all()
+
+
+def _run(callbacks, phase: str):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"{phase} callback {callback.__name__} failed: {e}")
+
+
+def begin_drain():
+    """Stop accepting work. Safe to call more than once."""
+    global _drain_thread
+    with _condition:
+        if _state["draining"]:
+            return
+        _state["draining"] = True
+    logging.info(f"Draining: {_state['inflight']} commands in flight")
+    _drain_thread = threading.Thread(target=_run, args=(_drain_callbacks, 'Drain'), name='drain', daemon=True)
+    _drain_thread.start()
+
+
+def shutdown(timeout: float = DRAIN_TIMEOUT):
+    """Drain, wait for in-flight commands, then flush. Call from the lifespan shutdown."""
+    begin_drain()
+    deadline = time.monotonic() + timeout
+    _drain_thread.join(timeout)
+    with _condition:
+        idle = _condition.wait_for(lambda: _state["inflight"] == 0, max(0, deadline - time.monotonic()))
+    if not idle:
+        logging.warning(f"Shutting down with {_state['inflight']} commands still in flight")
+    _run(_flush_callbacks, 'Flush')
+    logging.info("Shutdown complete")
+
+
+def install_signal_handler():
+    """Start draining on SIGTERM, then hand the signal to the server's own handler."""
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Not the main thread (e.g. the test client); shutdown() still drains
+        pass
+
+
+def get_status() -> dict:
+    return {
+        "ready": is_ready(),
+        "draining": _state["draining"],
+        "inflight": _state["inflight"],
+        "uptime": round(time.time() - _state["started"], 1) if _state["started"] else None,
+    }
@@ -0,0 +1,114 @@
+"""
+Maintenance tasks, run from the application directory (e.g. by curtains-maintenance.timer):
+
+    python maintenance.py compact-stats [--dry-run]
+    python maintenance.py backfill-analytics --before YYYY-MM-DD
+    python maintenance.py snapshot
+    python maintenance.py snapshots
+    python maintenance.py verify <snapshot id>
+    python maintenance.py restore <snapshot id> [--target DIR]
+
+compact-stats rolls the daily statistics CSVs of closed months into monthly archives
+and the months of closed years into yearly archives (see StatisticsManager.compact).
+backfill-analytics replays the statistics of the days before analytics started
+counting (pass that day) into the analytics counters, once (see analytics.py).
+snapshot takes a point-in-time snapshot of all stores while the service runs, and
+restore puts one back (stop the service first, or restore into --target).
+See snapshots.py.
+"""
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+
+import analytics
+import snapshots
+from statistics import StatisticsManager
+from utils import setup_logging
+
+
+def compact_stats(args):
+    summary = StatisticsManager(args.stats_dir).compact(dry_run=args.dry_run)
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} months: {', '.join(summary['months']) or 'none'}; years: {', '.join(summary['years']) or 'none'}; "
+          f"{summary['files_removed']} files removed")
+    return 0
+
+
+def backfill_analytics(args):
+    try:
+        last_day = (args.before - timedelta(days=1)).isoformat()
+        summary = analytics.backfill(StatisticsManager(args.stats_dir).iter_stats(end=last_day), args.before)
+    except ValueError as e:
+        print(f"Not backfilled: {e}")
+        return 1
+    print(f"Backfilled {summary['commands']} commands of {summary['rooms']} rooms in years "
+          f"{', '.join(map(str, summary['years'])) or 'none'}")
+    return 0
+
+
+def take_snapshot(args):
+    summary = snapshots.create_snapshot()
+    print(f"Snapshot {summary['id']}: {summary['files']} files, {summary['changed']} changed since the previous one")
+    return 0
+
+
+def list_snapshots(args):
+    for summary in snapshots.list_snapshots():
+        created = datetime.fromtimestamp(summary['created']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{summary['id']:<20} {created}  {summary['files']:>6} files  {summary['bytes']:>12} bytes")
+    return 0
+
+
+def verify_snapshot(args):
+    problems = snapshots.verify(args.snapshot_id)
+    for problem in problems:
+        print(problem)
+    print(f"Snapshot {args.snapshot_id}: {'FAILED' if problems else 'OK'}")
+    return 1 if problems else 0
+
+
+def restore_snapshot(args):
+    try:
+        summary = snapshots.restore(args.snapshot_id, args.target)
+    except ValueError as e:
+        print(f"Not restored: {e}")
+        return 1
+    print(f"Restored snapshot {summary['id']}: {summary['files']} files, {summary['removed']} newer files removed")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compact = commands.add_parser('compact-stats', help="roll closed days into monthly and yearly archives")
+    compact.add_argument('--stats-dir', default='stats')
+    compact.add_argument('--dry-run', action='store_true', help="only list what would be archived")
+    compact.set_defaults(func=compact_stats)
+
+    backfill = commands.add_parser('backfill-analytics', help="count the statistics from before analytics existed")
+    backfill.add_argument('--stats-dir', default='stats')
+    backfill.add_argument('--before', type=date.fromisoformat, required=True,
+                          help="the first day analytics counted by themselves (usually the day of the upgrade)")
+    backfill.set_defaults(func=backfill_analytics)
+
+    commands.add_parser('snapshot', help="snapshot all stores").set_defaults(func=take_snapshot)
+    commands.add_parser('snapshots', help="list the kept snapshots").set_defaults(func=list_snapshots)
+
+    verify = commands.add_parser('verify', help="check the checksums of a snapshot")
+    verify.add_argument('snapshot_id')
+    verify.set_defaults(func=verify_snapshot)
+
+    restore = commands.add_parser('restore', help="restore a snapshot (stop the service first)")
+    restore.add_argument('snapshot_id')
+    restore.add_argument('--target', help="restore into this directory instead of over the live stores")
+    restore.set_defaults(func=restore_snapshot)
+
+    args = parser.parse_args()
+    setup_logging()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Points module - append-only ledger of point changes and a ranking built from it.
+
+Every change of a user's points is appended to POINTS_LEDGER_FILE as a JSON line
+(user, delta, reason, time) by users.py, under the users lock and after users.json
+is saved. Each worker keeps a ranking of all balances in memory and catches up by
+reading only the ledger bytes appended since its last read. The ranking is an
+indexable skip list, so a point change, a rank query and the first entries of the
+leaderboard take O(log n) instead of a scan of every user.
+
+The first ledger is seeded with an "opening_balance" entry per user holding points.
+Only the last POINTS_HISTORY_LIMIT entries of each user are kept in memory.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+POINTS_LEDGER_FILE = os.getenv('POINTS_LEDGER_FILE', 'points.jsonl')
+# Ledger entries kept in memory per user for get_history
+POINTS_HISTORY_LIMIT = int(os.getenv('POINTS_HISTORY_LIMIT', '100'))
+
+
+_MAX_LEVEL = 24  # enough for 2**24 users
+_END_KEY = (float('inf'),)  # sorts after every (-points, username)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, height: int):
+        self.key = key
+        self.next = [None] * height
+        self.width = [1] * height  # bottom-level steps to next[level]
+
+
+class _SkipList:
+    """Sorted unique keys with O(log n) expected insert, remove and count of smaller keys."""
+
+    def __init__(self):
+        self._end = _Node(_END_KEY, 0)
+        self._head = _Node(None, _MAX_LEVEL)
+        self._head.next = [self._end] * _MAX_LEVEL
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not self._end:
+            yield node.key
+            node = node.next[0]
+
+    def _chain(self, key):
+        """The last node before `key` on each level, and the bottom-level steps taken on each level."""
+        chain = [None] * _MAX_LEVEL
+        steps = [0] * _MAX_LEVEL
+        node = self._head
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps = self._chain(key)
+        height = 1
+        while height < _MAX_LEVEL and random.random() < 0.5:
+            height += 1
+        node = _Node(key, height)
+        distance = 0  # from chain[level] to the new node
+        for level in range(height):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - distance
+            previous.width[level] = distance + 1
+            distance += steps[level]
+        for level in range(height, _MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node.key != key:
+            raise KeyError(key)
+        for level, following in enumerate(node.next):
+            chain[level].width[level] += node.width[level] - 1
+            chain[level].next[level] = following
+        for level in range(len(node.next), _MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def count_less(self, key) -> int:
+        position = 0
+        node = self._head
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+
+class Ranking:
+    """Balances ordered by points (descending), then username."""
+
+    def __init__(self):
+        self.balances = {}
+        self.history = {}
+        self.ordered = _SkipList()  # (-points, username)
+
+    def apply(self, entry: dict):
+        username = entry['user']
+        old = self.balances.get(username)
+        if old is not None:
+            self.ordered.remove((-old, username))
+        new = (old or 0) + entry['delta']
+        self.balances[username] = new
+        self.ordered.insert((-new, username))
+        if username not in self.history:
+            self.history[username] = deque(maxlen=POINTS_HISTORY_LIMIT)
+        self.history[username].append(entry)
+
+    def rank(self, username: str):
+        """1-based rank (ties share a rank), or None for users without points history."""
+        if username not in self.balances:
+            return None
+        return self.ordered.count_less((-self.balances[username], '')) + 1
+
+    def top(self, limit: int) -> list:
+        leaders = []
+        rank, previous = 0, None
+        for position, (negative_points, username) in enumerate(islice(self.ordered, limit), 1):
+            if negative_points != previous:
+                rank, previous = position, negative_points
+            leaders.append({"rank": rank, "username": username, "points": -negative_points})
+        return leaders
+
+
+_ranking = Ranking()
+_offset = 0
+_inode = None
+_lock = threading.Lock()
+
+
+def exists() -> bool:
+    return os.path.exists(POINTS_LEDGER_FILE)
+
+
+def append(username: str, delta: int, reason: str):
+    """Append a point change to the ledger. Call while holding the users lock, after saving users."""
+    _write([{"user": username, "delta": delta, "reason": reason, "time": time.time()}])
+
+
+def seed(balances: dict):
+    """Start the ledger from the current balances. Call while holding the users lock."""
+    now = time.time()
+    entries = [{"user": username, "delta": points, "reason": "opening_balance", "time": now}
+               for username, points in balances.items() if points]
+    _write(entries)
+    logging.info(f"Seeded points ledger with {len(entries)} balances")
+
+
+def _write(entries: list):
+    data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+    # A single O_APPEND write, so readers never see half of an entry followed by another one
+    fd = os.open(POINTS_LEDGER_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _catch_up() -> Ranking:
+    """Apply ledger entries appended since the last call."""
+    global _ranking, _offset, _inode
+    try:
+        stat = os.stat(POINTS_LEDGER_FILE)
+    except FileNotFoundError:
+        return _ranking
+    if stat.st_size == _offset and stat.st_ino == _inode:
+        return _ranking
+
+    with _lock:
+        # Stat again: another thread may have caught up while we waited for the lock
+        try:
+            stat = os.stat(POINTS_LEDGER_FILE)
+        except FileNotFoundError:
+            return _ranking
+        if stat.st_ino != _inode or stat.st_size < _offset:
+            if _inode is not None:
+                # The ledger was replaced (e.g. restored from a backup) or truncated: rebuild
+                logging.info("Points ledger was replaced, rebuilding the ranking")
+            _ranking, _offset, _inode = Ranking(), 0, stat.st_ino
+        if stat.st_size == _offset:
+            return _ranking
+        with open(POINTS_LEDGER_FILE, 'rb') as f:
+            if os.fstat(f.fileno()).st_ino != _inode:
+                # Replaced between the stat and the open; the next call rebuilds
+                return _ranking
+            f.seek(_offset)
+            data = f.read(stat.st_size - _offset)
+        # Only complete lines; a partial last line is read again next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            try:
+                _ranking.apply(json.loads(line))
+            except (ValueError, KeyError) as e:
+                logging.error(f"Skipping invalid points ledger entry: {e}")
+        _offset += len(complete)
+    return _ranking
+
+
+def get_leaderboard(limit: int = 10) -> list:
+    return _catch_up().top(limit)
+
+
+def get_standing(username: str) -> dict:
+    ranking = _catch_up()
+    return {
+        "username": username,
+        "points": ranking.balances.get(username, 0),
+        "rank": ranking.rank(username),
+        "users_ranked": len(ranking.ordered),
+    }
+
+
+def get_history(username: str, limit: int = POINTS_HISTORY_LIMIT) -> list:
+    """The user's most recent ledger entries (at most POINTS_HISTORY_LIMIT), newest first."""
+    return list(islice(reversed(_catch_up().history.get(username, ())), limit))
@@ -0,0 +1,186 @@
+"""
+Profiling module - opt-in capture of slow requests.
+
+When PROFILING_ENABLED is set, SlowRequestMiddleware times every request, collects
+per-phase timings reported through `phase()` and samples the call stack of the
+handling thread. Requests slower than PROFILING_THRESHOLD_MS are written to a bounded
+ring of JSON files in PROFILING_DIR. When disabled, the middleware is not installed
+and `phase()` is a context variable lookup.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from config import PROFILING_DIR, PROFILING_RING_SIZE, PROFILING_SAMPLE_INTERVAL_MS, PROFILING_THRESHOLD_MS
+from utils import after_fork
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    """Timings and stack samples collected for a single request."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.start_counter = time.perf_counter()
+        self.phases = []
+        self.thread_ids = set()
+        self.stacks = Counter()
+
+    def to_dict(self, duration_ms: float, status_code: int) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "timestamp": self.started,
+            "pid": os.getpid(),
+            "duration_ms": round(duration_ms, 3),
+            "status_code": status_code,
+            "phases": self.phases,
+            "stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(20)],
+        }
+
+
+@contextmanager
+def phase(name: str):
+    """Record the duration of a block as a named phase of the current request."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    profile.thread_ids.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases.append({
+            "name": name,
+            "start_ms": round((start - profile.start_counter) * 1000, 3),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+        })
+
+
+class _StackSampler:
+    """Background thread sampling the stacks of threads serving profiled requests."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, profile: RequestProfile):
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self.thread.start()
+
+    def unregister(self, profile: RequestProfile):
+        with self.lock:
+            self.active.discard(profile)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                profiles = list(self.active)
+            if not profiles:
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                for thread_id in list(profile.thread_ids):
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = ';'.join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                                     for entry in traceback.extract_stack(frame))
+                    profile.stacks[stack] += 1
+
+
+_sampler = _StackSampler(PROFILING_SAMPLE_INTERVAL_MS / 1000)
+
+
+@after_fork
+def _reset_sampler():
+    global _sampler
+    _sampler = _StackSampler(PROFILING_SAMPLE_INTERVAL_MS / 1000)
+
+
+def _write_profile(record: dict):
+    """Write a profile record into the on-disk ring, dropping the oldest entries."""
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    filename = f"{time.time_ns()}_{os.getpid()}.json"
+    with open(os.path.join(PROFILING_DIR, filename), 'w') as f:
+        json.dump(record, f)
+
+    entries = sorted(name for name in os.listdir(PROFILING_DIR) if name.endswith('.json'))
+    for name in entries[:-PROFILING_RING_SIZE]:
+        try:
+            os.remove(os.path.join(PROFILING_DIR, name))
+        except OSError:
+            pass
+
+
+def get_slow_requests(limit: int = 50) -> list:
+    """Return the most recent slow request profiles, newest first."""
+    if not os.path.exists(PROFILING_DIR):
+        return []
+
+    records = []
+    entries = sorted((name for name in os.listdir(PROFILING_DIR) if name.endswith('.json')), reverse=True)
+    for name in entries[:limit]:
+        try:
+            with open(os.path.join(PROFILING_DIR, name), 'r') as f:
+                records.append(json.load(f))
+        except (json.JSONDecodeError, IOError):
+            # The entry may have been rotated out by another worker
+            continue
+    return records
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware that profiles requests and records the slow ones."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope['method'], scope['path'])
+        profile.thread_ids.add(threading.get_ident())
+        token = _current_profile.set(profile)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        _sampler.register(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _sampler.unregister(profile)
+            _current_profile.reset(token)
+            duration_ms = (time.perf_counter() - profile.start_counter) * 1000
+            if duration_ms >= PROFILING_THRESHOLD_MS:
+                try:
+                    _write_profile(profile.to_dict(duration_ms, status_code))
+                except Exception as e:
+                    logging.error(f"Failed to write slow request profile: {e}")
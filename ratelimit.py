@@ -0,0 +1,133 @@
+"""
+Rate limit module - token buckets shared by all workers.
+
+Each limited route has a capacity and a window in RATE_LIMITS ("control=10/60" lets
+a key burst 10 requests and refills 10 tokens per 60 seconds). A request takes one
+token from the bucket of every key it is limited by (user, room); if any bucket is
+empty nothing is taken and the request is rejected with 429 before the handler does
+any storage or controller work. Limits are off unless RATE_LIMITS is set.
+
+Limiting by client IP is opt-in with a separate "<name>.ip" entry: behind the office
+NAT or the nginx proxy many users share one IP, so it needs a much larger capacity
+(e.g. "control.ip=600/60").
+
+Buckets are rows in the shared database, updated in one short write transaction.
+When the database is unavailable requests are let through rather than failed.
+"""
+
+import logging
+import time
+from functools import wraps
+
+from fastapi import HTTPException, Request
+
+from config import RATE_LIMITS
+from db import register_schema, transaction
+from utils import get_client_ip
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+""")
+
+# Buckets idle for a full window are full again, so they are dropped every few minutes
+_PURGE_INTERVAL = 300
+_last_purge = 0.0
+
+
+def parse_limits(spec: str) -> dict:
+    """Parse 'name=capacity/seconds,...' into {name: (capacity, seconds)}."""
+    limits = {}
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        try:
+            name, rate = entry.split('=')
+            capacity, seconds = rate.split('/')
+            limits[name.strip()] = (float(capacity), float(seconds))
+        except ValueError:
+            logging.error(f"Ignoring invalid rate limit '{entry}', expected name=capacity/seconds")
+    return limits
+
+
+LIMITS = parse_limits(RATE_LIMITS)
+
+
+def consume(buckets: list) -> float:
+    """Take a token from each (limit name, key) bucket. Returns 0 if allowed, else seconds to wait."""
+    global _last_purge
+    now = time.time()
+    rates = {}  # bucket key -> (capacity, refill rate)
+    for name, key in buckets:
+        capacity, seconds = LIMITS[name]
+        rates[f"{name}:{key}"] = (capacity, capacity / seconds)
+
+    with transaction() as connection:
+        placeholders = ','.join('?' * len(rates))
+        rows = {key: (tokens, updated) for key, tokens, updated in connection.execute(
+            f"SELECT key, tokens, updated FROM rate_buckets WHERE key IN ({placeholders})", list(rates))}
+        tokens = {}
+        wait = 0
+        for key, (capacity, refill_rate) in rates.items():
+            if key in rows:
+                stored, updated = rows[key]
+                tokens[key] = min(capacity, stored + (now - updated) * refill_rate)
+            else:
+                tokens[key] = capacity
+            if tokens[key] < 1:
+                wait = max(wait, (1 - tokens[key]) / refill_rate)
+        if wait:
+            return wait
+
+        connection.executemany(
+            "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            [(key, value - 1, now) for key, value in tokens.items()])
+        if now - _last_purge >= _PURGE_INTERVAL:
+            _last_purge = now
+            longest_window = max(limit[1] for limit in LIMITS.values())
+            connection.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - longest_window,))
+    return 0
+
+
+def rate_limit(name: str, by=('user',)):
+    """
+    Decorator limiting an endpoint with the named limit from RATE_LIMITS.
+
+    by lists the keys to limit on: 'user' (signed-in username) and 'room' (the
+    room_name path parameter). The client IP is limited too when RATE_LIMITS has a
+    "<name>.ip" entry. Place it below @require_auth.
+    """
+    ip_limit = f"{name}.ip"
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            request: Request = kwargs.get('request')
+            buckets = []
+            if name in LIMITS:
+                if 'user' in by and request.session.get('user_name'):
+                    buckets.append((name, f"user:{request.session['user_name']}"))
+                if 'room' in by and kwargs.get('room_name'):
+                    buckets.append((name, f"room:{kwargs['room_name'].upper()}"))
+            if ip_limit in LIMITS:
+                buckets.append((ip_limit, f"ip:{get_client_ip(request)}"))
+            if not buckets:
+                return func(*args, **kwargs)
+
+            try:
+                retry_after = consume(buckets)
+            except Exception as e:
+                logging.error(f"Rate limiter unavailable, allowing request: {e}")
+                retry_after = 0
+            if retry_after:
+                logging.warning(f"Rate limited {name} for {', '.join(key for _, key in buckets)}")
+                raise HTTPException(status_code=429, detail="Too many requests, please slow down",
+                                    headers={"Retry-After": str(int(retry_after) + 1)})
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,200 @@
+"""
+Reports module - buffered, batched ingestion of problem reports.
+
+/submit-report only appends the report to an in-memory buffer. A background thread
+writes the buffer to REPORTS_FILE every REPORTS_FLUSH_INTERVAL seconds (or as soon
+as REPORTS_BATCH_SIZE reports are waiting) with one open, one write and one fsync
+per batch, under a lock file shared by the workers. Records are JSON lines; the
+file is rotated to REPORTS_FILE.1 ... REPORTS_FILE.N once it exceeds
+REPORTS_MAX_BYTES.
+
+Reports still in the buffer when a worker dies are lost, so shutdown calls flush().
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Optional
+
+from config import REPORTS_BACKUP_COUNT, REPORTS_BATCH_SIZE, REPORTS_FILE, REPORTS_FLUSH_INTERVAL, REPORTS_MAX_BYTES
+from utils import after_fork, file_lock
+
+
+class ReportBuffer:
+    """Reports waiting to be written, and the thread that writes them."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = []
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.thread = None
+
+    def add(self, record: dict):
+        with self.condition:
+            self.pending.append(record)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='report-flusher', daemon=True)
+                self.thread.start()
+            if len(self.pending) >= REPORTS_BATCH_SIZE:
+                self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.pending) >= REPORTS_BATCH_SIZE, REPORTS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Failed to write reports: {e}")
+
+    def flush(self) -> int:
+        """Write all pending reports with a single fsync. Returns how many were written."""
+        with self.write_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+
+            data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch).encode('utf-8')
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                with file_lock(self.path):
+                    self._rotate(len(data))
+                    fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                    try:
+                        os.write(fd, data)
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+            except Exception:
+                # Keep the batch for the next attempt
+                with self.condition:
+                    self.pending[:0] = batch
+                raise
+            return len(batch)
+
+    def _rotate(self, incoming: int):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size == 0 or size + incoming <= REPORTS_MAX_BYTES:
+            return
+        for index in range(REPORTS_BACKUP_COUNT - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        logging.info(f"Rotated {self.path}")
+
+
+_buffer = ReportBuffer(REPORTS_FILE)
+_line_counts = {}  # path -> (inode, bytes counted, reports in them, last bytes counted)
+
+
+@after_fork
+def _reset_buffer():
+    global _buffer
+    _buffer = ReportBuffer(REPORTS_FILE)
+
+
+def add_report(report: str, username: Optional[str], ip: Optional[str], room: Optional[str] = None):
+    """Queue a report for writing."""
+    _buffer.add({
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "user": username,
+        "ip": ip,
+        "room": room,
+        "report": report,
+    })
+
+
+def flush() -> int:
+    """Write this worker's pending reports now."""
+    return _buffer.flush()
+
+
+def _parse_line(line: str) -> Optional[dict]:
+    try:
+        return json.loads(line)
+    except ValueError:
+        pass
+    # Reports written before the JSON format: "<timestamp> - <ip> - <report>"
+    parts = line.split(' - ', 2)
+    if len(parts) != 3:
+        return None
+    return {"timestamp": parts[0], "user": None, "ip": parts[1], "room": None, "report": parts[2]}
+
+
+def _count_reports(f) -> tuple:
+    """(bytes, reports) of the complete lines of an open reports file.
+
+    Counts are kept per path: a rotated file is counted once, and the current file only
+    from where the previous count stopped. The last bytes counted are kept as well, since
+    a new file can get the inode of a removed one.
+    """
+    stat = os.fstat(f.fileno())
+    inode, counted, count, tail = _line_counts.get(f.name, (None, 0, 0, b''))
+    if inode != stat.st_ino or stat.st_size < counted:
+        counted, count, tail = 0, 0, b''
+    elif tail:
+        f.seek(counted - len(tail))
+        if f.read(len(tail)) != tail:
+            counted, count, tail = 0, 0, b''
+    if stat.st_size > counted:
+        f.seek(counted)
+        data = f.read(stat.st_size - counted)
+        complete = data[:data.rfind(b'\n') + 1]
+        count += sum(1 for line in complete.splitlines() if line.strip())
+        counted += len(complete)
+        tail = (tail + complete)[-64:]
+    _line_counts[f.name] = (stat.st_ino, counted, count, tail)
+    return counted, count
+
+
+def _read_page(f, size: int, skip: int, limit: int) -> list:
+    """Up to `limit` reports of an open file, newest first, after skipping the `skip` newest."""
+    f.seek(0)
+    lines = [line for line in f.read(size).splitlines() if line.strip()]
+    end = len(lines) - skip
+    reports = []
+    for line in reversed(lines[max(0, end - limit):end]):
+        record = _parse_line(line.decode('utf-8', errors='replace'))
+        if record is not None:
+            reports.append(record)
+    return reports
+
+
+def get_reports(offset: int = 0, limit: int = 50) -> dict:
+    """Page through reports, newest first, across the current and rotated files.
+
+    Only the files overlapping the page are read, and only the reports on it parsed.
+    """
+    flush()
+    reports = []
+    total = 0
+    paths = [REPORTS_FILE] + [f"{REPORTS_FILE}.{index}" for index in range(1, REPORTS_BACKUP_COUNT + 1)]
+    with ExitStack() as stack:
+        # Keep every file open while paging, so a rotation in between does not shift the page
+        files = []
+        for path in paths:
+            try:
+                f = stack.enter_context(open(path, 'rb'))
+            except FileNotFoundError:
+                continue
+            files.append((f, *_count_reports(f)))
+
+        for f, size, count in files:
+            # Reports total .. total + count of the newest-first order are in this file
+            if total + count > offset and total < offset + limit:
+                skip = max(0, offset - total)
+                take = min(offset + limit, total + count) - (total + skip)
+                reports.extend(_read_page(f, size, skip, take))
+            total += count
+    return {"total": total, "offset": offset, "limit": limit, "reports": reports}
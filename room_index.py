@@ -0,0 +1,77 @@
+"""
+Room index module - prefix and fuzzy search over the room catalog (rooms.json).
+
+The index is a sorted list of room names, so a prefix query is two bisects and a
+slice. When too few rooms share the prefix, the rest are filled with close matches
+(difflib), so a typo still finds the room. The index is rebuilt when
+rooms.json changes on disk; its ETag lets clients revalidate results for free.
+"""
+
+import difflib
+import hashlib
+import os
+import threading
+from bisect import bisect_left
+from email.utils import formatdate
+from typing import Optional
+
+from helper import ROOMS_FILE, load_rooms_data
+
+FUZZY_CUTOFF = 0.6
+# Room numbers are digits after the building letter; letters typed there are usually these
+DIGIT_LOOKALIKES = str.maketrans({'O': '0', 'I': '1', 'L': '1'})
+
+
+class RoomIndex:
+    """Sorted room names with their directions, for one version of the catalog.
+
+    Has the etag/mtime/last_modified of a documents.CachedDocument, so search
+    results can be served with documents.conditional_response.
+    """
+
+    def __init__(self, rooms: dict, mtime: float, size: int):
+        self.names = sorted(name.upper() for name in rooms)
+        self.directions = {name.upper(): [state.get('name') for state in states] for name, states in rooms.items()}
+        self.by_building = {}
+        for name in self.names:
+            self.by_building.setdefault(name[1:2], []).append(name)
+        self.mtime = mtime
+        self.size = size
+        self.etag = f'"{hashlib.sha256(f"{mtime}:{size}".encode()).hexdigest()[:16]}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+    def _prefix(self, names: list, prefix: str, limit: int) -> list:
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + '\uffff', start)
+        return names[start:min(end, start + limit)]
+
+    def search(self, query: str, building: Optional[str] = None, limit: int = 10) -> list:
+        query = query.strip().upper()
+        query = query[:2] + query[2:].translate(DIGIT_LOOKALIKES)
+        names = self.by_building.get(building, []) if building else self.names
+        matches = self._prefix(names, query, limit)
+        if len(matches) < limit and query:
+            found = set(matches)
+            close = difflib.get_close_matches(query, names, n=limit * 5, cutoff=FUZZY_CUTOFF)
+            # Among similar names, prefer those agreeing on floor and building (the start of the name)
+            close.sort(key=lambda name: -len(os.path.commonprefix([name, query])))
+            matches += [name for name in close if name not in found][:limit - len(matches)]
+        return [{"room": name, "building": name[1:2], "directions": self.directions[name]} for name in matches]
+
+
+_index = RoomIndex({}, 0, 0)
+_lock = threading.Lock()
+
+
+def get_index() -> RoomIndex:
+    """The index of the current catalog, rebuilt if rooms.json changed."""
+    global _index
+    try:
+        stat = os.stat(ROOMS_FILE)
+    except FileNotFoundError:
+        return _index
+    if (stat.st_mtime, stat.st_size) != (_index.mtime, _index.size):
+        with _lock:
+            if (stat.st_mtime, stat.st_size) != (_index.mtime, _index.size):
+                _index = RoomIndex(load_rooms_data(), stat.st_mtime, stat.st_size)
+    return _index
@@ -0,0 +1,318 @@
+"""
+Schedules module - recurring curtain commands ("down at 14:00 every weekday").
+
+Schedules are rows in the shared database. Every worker runs a scheduler thread,
+but only the holder of the scheduler lease (a row renewed every few seconds, taken
+over by another worker once it expires) fires them, so each schedule fires once.
+
+The leader keeps the next run of every enabled schedule in a heap and sleeps until
+the earliest one is due. All schedules due at the same moment are handled as one
+batch: their next runs are written in one transaction before anything is sent
+(a schedule fires at most once, even across a leader change), then their commands
+go to a small thread pool per building, so a thousand schedules on the same minute
+reach each controller SCHEDULER_CONCURRENCY at a time.
+
+Runs missed by more than SCHEDULE_MISFIRE_GRACE seconds (e.g. during a restart) are
+skipped rather than replayed. When the worker drains, commands already fired are still
+sent for up to DRAIN_TIMEOUT seconds; any left after that are logged as not sent.
+"""
+
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, time as day_time, timedelta
+from typing import Optional
+
+from config import DRAIN_TIMEOUT, SCHEDULE_MISFIRE_GRACE, SCHEDULER_CONCURRENCY, SCHEDULER_ENABLED, SCHEDULER_LEASE_TTL
+from db import get_connection, register_schema, transaction
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+LEASE_NAME = 'scheduler'
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    rooms TEXT NOT NULL,
+    direction TEXT,
+    action TEXT NOT NULL,
+    days TEXT NOT NULL,
+    at TEXT NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    last_run REAL,
+    next_run REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS schedules_username ON schedules (username);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+""")
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_thread = None
+
+
+def parse_time(value: str):
+    """Parse 'HH:MM' into (hour, minute); raises ValueError."""
+    hour, minute = value.split(':')
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"invalid time {value}")
+    return hour, minute
+
+
+def next_run_after(days: list, at: str, after: float) -> float:
+    """The first moment after `after` (local time) falling on one of the weekdays at HH:MM."""
+    hour, minute = parse_time(at)
+    start = datetime.fromtimestamp(after)
+    for offset in range(8):
+        candidate = datetime.combine(start.date() + timedelta(days=offset), day_time(hour, minute))
+        if candidate.weekday() in days and candidate.timestamp() > after:
+            return candidate.timestamp()
+    raise ValueError("a schedule needs at least one day")
+
+
+def _to_dict(row) -> dict:
+    return {
+        "id": row['id'],
+        "username": row['username'],
+        "rooms": row['rooms'].split(','),
+        "direction": row['direction'],
+        "action": row['action'],
+        "days": [DAYS[day] for day in _days(row)],
+        "time": row['at'],
+        "enabled": bool(row['enabled']),
+        "last_run": row['last_run'],
+        "next_run": row['next_run'],
+    }
+
+
+def _days(row) -> list:
+    return [int(day) for day in row['days'].split(',')]
+
+
+def create_schedule(username: str, rooms: list, action: str, days: list, at: str,
+                    direction: Optional[str] = None) -> dict:
+    """Store a new schedule; days are weekday numbers (Monday is 0)."""
+    now = time.time()
+    next_run = next_run_after(days, at, now)
+    with transaction() as connection:
+        schedule_id = connection.execute(
+            "INSERT INTO schedules (username, rooms, direction, action, days, at, created, updated, next_run) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (username, ','.join(rooms), direction, action, ','.join(str(day) for day in sorted(set(days))), at,
+             now, now, next_run)).lastrowid
+    _wakeup.set()
+    return get_schedule(schedule_id)
+
+
+def get_schedule(schedule_id: int) -> Optional[dict]:
+    row = get_connection().execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def list_schedules(username: Optional[str] = None) -> list:
+    """Schedules of a user, or of everyone."""
+    if username is None:
+        rows = get_connection().execute("SELECT * FROM schedules ORDER BY id").fetchall()
+    else:
+        rows = get_connection().execute("SELECT * FROM schedules WHERE username = ? ORDER BY id", (username,)).fetchall()
+    return [_to_dict(row) for row in rows]
+
+
+def count_schedules(username: str) -> int:
+    return get_connection().execute("SELECT COUNT(*) FROM schedules WHERE username = ?", (username,)).fetchone()[0]
+
+
+def set_enabled(schedule_id: int, enabled: bool):
+    now = time.time()
+    with transaction() as connection:
+        row = connection.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        if row is None:
+            return
+        # A re-enabled schedule continues from now, not from where it stopped
+        next_run = next_run_after(_days(row), row['at'], now)
+        connection.execute("UPDATE schedules SET enabled = ?, updated = ?, next_run = ? WHERE id = ?",
+                           (int(enabled), now, next_run, schedule_id))
+    _wakeup.set()
+
+
+def delete_schedule(schedule_id: int):
+    with transaction() as connection:
+        connection.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+    _wakeup.set()
+
+
+# ============== Scheduler ==============
+
+def _holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _acquire_lease(now: float) -> bool:
+    """Take or renew the scheduler lease. Returns True while this worker is the leader."""
+    holder = _holder_id()
+    with transaction() as connection:
+        connection.execute(
+            "INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires "
+            "WHERE leases.holder = excluded.holder OR leases.expires < ?",
+            (LEASE_NAME, holder, now + SCHEDULER_LEASE_TTL, now))
+        row = connection.execute("SELECT holder FROM leases WHERE name = ?", (LEASE_NAME,)).fetchone()
+    return row['holder'] == holder
+
+
+def _release_lease():
+    with transaction() as connection:
+        connection.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (LEASE_NAME, _holder_id()))
+
+
+def get_leader() -> Optional[dict]:
+    row = get_connection().execute("SELECT holder, expires FROM leases WHERE name = ?", (LEASE_NAME,)).fetchone()
+    if row is None or row['expires'] < time.time():
+        return None
+    return {"holder": row['holder'], "expires": row['expires']}
+
+
+def _schedules_version():
+    """Changes whenever a schedule is added, changed or removed."""
+    return tuple(get_connection().execute("SELECT COUNT(*), MAX(updated) FROM schedules").fetchone())
+
+
+def _load_heap() -> list:
+    rows = get_connection().execute("SELECT next_run, id FROM schedules WHERE enabled = 1").fetchall()
+    heap = [(row['next_run'], row['id']) for row in rows]
+    heapq.heapify(heap)
+    return heap
+
+
+class _Dispatcher:
+    """One bounded thread pool per building, so schedules cannot stampede a controller."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.pools = {}
+        self.pending = {}  # future -> (schedule id, room), until the command was sent
+
+    def submit(self, schedule, room: str):
+        building = room[1:2]
+        if building not in self.pools:
+            self.pools[building] = ThreadPoolExecutor(max_workers=SCHEDULER_CONCURRENCY,
+                                                      thread_name_prefix=f'schedule-{building}')
+        future = self.pools[building].submit(self._run, schedule, room)
+        self.pending[future] = (schedule['id'], room)
+        future.add_done_callback(lambda done: self.pending.pop(done, None))
+
+    def _run(self, schedule, room: str):
+        try:
+            self.handler(room, schedule['action'], schedule['direction'], schedule['username'])
+        except Exception as e:
+            detail = getattr(e, 'detail', e)
+            logging.error(f"Schedule {schedule['id']} failed for room {room}: {detail}")
+
+    def shutdown(self, timeout: float):
+        """Send the commands already fired, waiting up to timeout seconds; log those left unsent."""
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+        pending = dict(self.pending)
+        if pending:
+            logging.info(f"Waiting for {len(pending)} scheduled commands before stopping")
+            wait(pending, timeout)
+        for future, (schedule_id, room) in pending.items():
+            if future.cancel():
+                logging.error(f"Schedule {schedule_id} was not sent to room {room}: the worker stopped first")
+        self.pools.clear()
+
+
+def _fire(due: list, now: float, dispatcher: _Dispatcher) -> list:
+    """Reschedule a batch of due schedules in one transaction, then send their commands."""
+    to_send = []
+    rescheduled = []
+    with transaction() as connection:
+        for next_run, schedule_id in due:
+            row = connection.execute("SELECT * FROM schedules WHERE id = ? AND enabled = 1",
+                                     (schedule_id,)).fetchone()
+            # Deleted, disabled or already moved on by a previous leader
+            if row is None or row['next_run'] != next_run:
+                continue
+            following = next_run_after(_days(row), row['at'], max(now, next_run))
+            connection.execute("UPDATE schedules SET last_run = ?, next_run = ? WHERE id = ?",
+                               (now, following, schedule_id))
+            rescheduled.append((following, schedule_id))
+            if now - next_run > SCHEDULE_MISFIRE_GRACE:
+                logging.warning(f"Skipping schedule {schedule_id}, missed by {int(now - next_run)}s")
+                continue
+            to_send.append(row)
+
+    for row in to_send:
+        for room in row['rooms'].split(','):
+            dispatcher.submit(row, room)
+    if to_send:
+        logging.info(f"Fired {len(to_send)} schedules")
+    return rescheduled
+
+
+def _run(handler):
+    dispatcher = _Dispatcher(handler)
+    heap = []
+    loaded_version = None
+    renew_interval = SCHEDULER_LEASE_TTL / 3
+    while not _stop.is_set():
+        now = time.time()
+        try:
+            if not _acquire_lease(now):
+                heap, loaded_version = [], None
+                _stop.wait(renew_interval)
+                continue
+
+            version = _schedules_version()
+            if version != loaded_version:
+                heap, loaded_version = _load_heap(), version
+
+            due = []
+            while heap and heap[0][0] <= now:
+                due.append(heapq.heappop(heap))
+            if due:
+                # Only next_run changes here, so the version stays and the heap is kept
+                for entry in _fire(due, now, dispatcher):
+                    heapq.heappush(heap, entry)
+        except Exception as e:
+            logging.error(f"Scheduler error: {e}")
+
+        timeout = renew_interval if not heap else min(renew_interval, max(0, heap[0][0] - time.time()))
+        _wakeup.wait(timeout)
+        _wakeup.clear()
+
+    dispatcher.shutdown(DRAIN_TIMEOUT)
+
+
+def start_scheduler(handler):
+    """Start this worker's scheduler thread; handler(room, action, direction, username) sends a command."""
+    global _thread
+    if not SCHEDULER_ENABLED:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, args=(handler,), name='scheduler', daemon=True)
+    _thread.start()
+
+
+def stop_scheduler(timeout: float = DRAIN_TIMEOUT + 1):
+    """Stop the scheduler thread (after it sent the commands already fired) and hand the lease over."""
+    if _thread is None:
+        return
+    _stop.set()
+    _wakeup.set()
+    _thread.join(timeout)
+    try:
+        _release_lease()
+    except Exception as e:
+        logging.error(f"Failed to release the scheduler lease: {e}")
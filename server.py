@@ -1,18 +1,40 @@
+import asyncio
+import gc
 import logging
+import sqlite3
+import time
 from datetime import datetime
 from functools import wraps
 
 import requests
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse, HTMLResponse, StreamingResponse
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.staticfiles import StaticFiles
 
+from assets import AssetFiles, load_manifest
 from auth import get_auth_app
+from circuit import get_controllers_health
+from compression import CompressionMiddleware
 from config import *
-from helper import get_suffix, get_username, get_states_by_direction, send_message, get_room_states
-from statistics import StatisticsManager
-from utils import get_client_ip, setup_logging
+from db import get_connection
+from documents import conditional_response, get_document, render_markdown
+from helper import get_suffix, get_username, get_states_by_direction, send_message, get_room_states, load_rooms_data
+from profiling import SlowRequestMiddleware, get_slow_requests, phase
+from ratelimit import rate_limit
+from room_index import get_index as get_room_index
+from sessions import end_session, get_principal, invalidate as invalidate_principal, list_sessions, \
+    revoke_user_sessions, start_session
+from statistics import StatisticsManager, export_csv, export_ndjson
+from utils import FastJSONResponse, get_client_ip, setup_logging
+import analytics
+import curtain_state
+import jobs
+import lifecycle
+import points
+import reports
+import schedules
+import snapshots
 import users
 
 # Setup logging before anything else
@@ -20,7 +42,7 @@ setup_logging()
 
 # Setup the FastAPI app
 load_dotenv()
-app = FastAPI(redirect_slashes=False)
+app = FastAPI(redirect_slashes=False, default_response_class=FastJSONResponse)
 
 # Add session middleware with a secret key
 # In test mode, use session cookies (expire when browser closes)
@@ -28,9 +50,22 @@ app = FastAPI(redirect_slashes=False)
 session_max_age = None if IS_TEST else 7 * 24 * 60 * 60
 app.add_middleware(SessionMiddleware, secret_key=COOKIES_KEY, max_age=session_max_age)
 
+# Compress large responses for clients that accept gzip/brotli
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Slow-request profiling is opt-in so it costs nothing when disabled
+if PROFILING_ENABLED:
+    app.add_middleware(SlowRequestMiddleware)
+
 # Constants for the server and authentication
 
-app.mount("/Frontend", StaticFiles(directory="Frontend"), name="Frontend")
+# Serve the fingerprinted build when one exists; the manifest is read once and shared by preloaded workers
+assets_manifest = load_manifest(ASSETS_BUILD_DIR)
+if assets_manifest:
+    app.mount("/Frontend", AssetFiles(directory=ASSETS_BUILD_DIR, manifest=assets_manifest), name="Frontend")
+else:
+    app.mount("/Frontend", StaticFiles(directory="Frontend"), name="Frontend")
 
 stats_manager = StatisticsManager()
 
@@ -52,13 +87,13 @@ def require_auth(func):
         if not request:
             raise HTTPException(status_code=500, detail="Request object not found")
         
-        # Check if user is authenticated
-        username = request.session.get('user_name')
-        if not username:
+        # Check if user is authenticated (resolved once per request)
+        if not get_principal(request):
             raise HTTPException(status_code=401, detail="You need to authenticate")
         
         # Call the original function
-        return func(*args, **kwargs)
+        with phase('handler'):
+            return func(*args, **kwargs)
     
     return wrapper
 
@@ -80,68 +115,105 @@ def require_admin(func):
         if not request:
             raise HTTPException(status_code=500, detail="Request object not found")
         
-        # Check if user is authenticated
-        username = request.session.get('user_name')
-        if not username:
+        # Check if user is authenticated (resolved once per request)
+        principal = get_principal(request)
+        if not principal:
             raise HTTPException(status_code=401, detail="You need to authenticate")
         
         # Check if user is admin (case-insensitive)
-        if username.lower() not in ADMIN_USERS:
+        if not principal.is_admin:
             raise HTTPException(status_code=403, detail="Admin access required")
         
         # Call the original function
-        return func(*args, **kwargs)
+        with phase('handler'):
+            return func(*args, **kwargs)
     
     return wrapper
 
 
 @app.get("/submit-report/{report}")
 @require_auth
-def submit_report(request: Request, report: str):
-    user_ip = get_client_ip(request)
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    report_entry = f"{current_time} - {user_ip} - {report}\n"
-
-    os.makedirs(os.path.dirname(REPORTS_FILE), exist_ok=True)
-    with open(REPORTS_FILE, "a") as file:
-        file.write(report_entry)
+@rate_limit('report')
+def submit_report(request: Request, report: str, room: str = None):
+    # Buffered; written to REPORTS_FILE in batches by reports.py
+    reports.add_report(report, request.session.get('user_name'), get_client_ip(request), room.upper() if room else None)
 
     return {"message": "Report submitted successfully"}
 
 
 @app.get("/whats-new")
-def get_whats_new():
-    """Serve the what's new markdown content"""
-    whats_new_file = "whats_new.md"
-    
-    if not os.path.exists(whats_new_file):
-        raise HTTPException(status_code=404, detail="What's new file not found")
-    
+def get_whats_new(request: Request, format: str = "markdown"):
+    """Serve the what's new content, as markdown or (format=html) rendered once on the server"""
     try:
-        with open(whats_new_file, "r", encoding="utf-8") as file:
-            content = file.read()
-        return PlainTextResponse(content=content, media_type="text/plain; charset=utf-8")
+        document = get_document("whats_new.md")
     except Exception as e:
         logging.error(f"Error reading what's new file: {e}")
         raise HTTPException(status_code=500, detail="Failed to read what's new content")
 
+    if document is None:
+        raise HTTPException(status_code=404, detail="What's new file not found")
 
-@app.get("/version")
-def get_version():
-    """Serve the current version from .version file"""
-    version_file = ".version"
-    
-    if not os.path.exists(version_file):
-        return {"version": "1.0"}
-    
+    if format == "html":
+        return conditional_response(request, document, lambda: HTMLResponse(
+            content=document.derive("html", render_markdown)), variant="html")
+    return conditional_response(request, document, lambda: PlainTextResponse(
+        content=document.content, media_type="text/plain; charset=utf-8"))
+
+
+def _get_version_document():
     try:
-        with open(version_file, "r", encoding="utf-8") as file:
-            version = file.read().strip()
-        return {"version": version}
+        return get_document(".version")
     except Exception as e:
         logging.error(f"Error reading version file: {e}")
+        return None
+
+
+@app.get("/version")
+def get_version(request: Request):
+    """Serve the current version from .version file"""
+    document = _get_version_document()
+    if document is None:
         return {"version": "1.0"}
 
+    return conditional_response(request, document, lambda: JSONResponse(
+        content={"version": document.content.strip()}))
+
+
+@app.get("/health/live")
+def get_liveness():
+    """The worker is up and serving requests."""
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@app.get("/health/ready")
+def get_readiness():
+    """Whether this worker should get traffic: started, not draining, and the shared database usable."""
+    status = lifecycle.get_status()
+    try:
+        get_connection().execute("SELECT 1")
+        database = "ok"
+    except sqlite3.Error as e:
+        database = f"error: {e}"
+    ready = status["ready"] and database == "ok"
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ready" if ready else "not_ready",
+        "pid": os.getpid(),
+        "database": database,
+        **status
+    })
+
+
+@app.get("/health/controllers")
+def get_controllers_health_status():
+    """Get the circuit breaker state of each building controller, as seen by this worker."""
+    controllers = get_controllers_health()
+    open_count = sum(1 for controller in controllers.values() if controller["state"] == "open")
+    return {
+        "status": "ok" if open_count == 0 else "degraded",
+        "pid": os.getpid(),
+        "controllers": controllers
+    }
+
 
 @app.get("/login")
 def login(request: Request):
@@ -179,37 +251,13 @@ def test_login(request: Request, username: str):
     if not username or username.strip() == '':
         username = 'Developer'
     
-    request.session['user_name'] = username
+    start_session(request, username)
     
-    # Check if user is NEW before creating
-    is_new_user = not users.user_exists(username)
-    logging.info(f"Test mode login: username={username}, is_new_user={is_new_user}")
-    
-    users.get_or_create_user(username)
-    logging.info(f"Test mode: logged in as {username} (new: {is_new_user})")
-    
-    # Process pending referral ONLY if this is a new user
-    logging.info(f"Pending referral: {pending_referral}, is_new_user: {is_new_user}")
-    if pending_referral and pending_referral != username and is_new_user:
-        logging.info(f"Processing referral for {pending_referral} from NEW user {username}")
-        users.process_referral(pending_referral, username)
-        users.add_points(pending_referral, 20)  # Grant 20 points for referral
-        
-        # Add success messages to both users
-        users.add_message(
-            pending_referral,
-            "success",
-            "Congratulations!",
-            f"{username} just signed up using your referral link! You got 20 points (you need 60 points to get Premium)! ✨"
-        )
-        users.add_message(
-            username,
-            "success",
-            "Thank You!",
-            f"{pending_referral} shared their referral link with you. They just earned 20 points thanks to you! 🎉"
-        )
-        
-        logging.info(f"Processed referral for {pending_referral} from NEW user {username}")
+    # Create the user and apply a pending referral in one transaction
+    result = users.sign_in_user(username, pending_referral)
+    logging.info(f"Test mode: logged in as {username} (new: {result['is_new_user']})")
+    if result['referral_applied']:
+        invalidate_principal(pending_referral)
     
     return RedirectResponse(url="/Frontend/index.html")
 
@@ -217,8 +265,8 @@ def test_login(request: Request, username: str):
 @app.get("/check-auth")
 def check_auth(request: Request):
     """Check if user is authenticated and return user info including premium status"""
-    username = request.session.get('user_name')
-    if not username:
+    principal = get_principal(request)
+    if not principal:
         return {
             'authenticated': False,
             'username': None,
@@ -228,10 +276,53 @@ def check_auth(request: Request):
 
     return {
         'authenticated': True,
-        'username': username,
-        'is_premium': users.is_premium(username),
-        'points': users.get_points(username),
-        'is_admin': username.lower() in ADMIN_USERS
+        'username': principal.username,
+        'is_premium': principal.is_premium,
+        'points': principal.points,
+        'is_admin': principal.is_admin
+    }
+
+
+@app.get("/api/bootstrap")
+def bootstrap(request: Request):
+    """Everything the index page needs on load: auth state, profile, version and unread messages"""
+    version_document = _get_version_document()
+    version = version_document.content.strip() if version_document else "1.0"
+
+    principal = get_principal(request)
+    if not principal:
+        return {
+            'authenticated': False,
+            'username': None,
+            'is_premium': False,
+            'is_admin': False,
+            'version': version
+        }
+
+    snapshot = users.get_user_snapshot(principal.username)
+    return {
+        'authenticated': True,
+        'username': principal.username,
+        'is_premium': snapshot['is_premium'],
+        'points': snapshot['points'],
+        'is_admin': principal.is_admin,
+        'rooms': snapshot['rooms'],
+        'messages': snapshot['messages'],
+        'version': version
+    }
+
+
+@app.get("/api/leaderboard")
+@require_auth
+def get_leaderboard(request: Request, limit: int = 10):
+    """Get the users with the most points and the current user's rank."""
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    
+    users.ensure_points_ledger()
+    return {
+        "leaders": points.get_leaderboard(limit),
+        "me": points.get_standing(request.session.get('user_name'))
     }
 
 
@@ -244,17 +335,14 @@ def get_messages(request: Request):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     messages = users.get_and_clear_messages(username)
-    logging.info(f"API /api/messages - Retrieved {len(messages)} messages for {username}")
-    if messages:
-        for msg in messages:
-            logging.info(f"  Message: {msg['type']} - {msg['title']}")
+    logging.debug(f"API /api/messages - Retrieved {len(messages)} messages for {username}")
     return {"messages": messages}
 
 
 @app.get("/logout")
 def logout(request: Request):
     """Clear user session"""
-    request.session.clear()
+    end_session(request)
     return RedirectResponse(url="/Frontend/index.html")
 
 
@@ -274,17 +362,24 @@ def register(request: Request, room_name: str):
     return directions
 
 
-@app.get("/control/{room_name}/{action}")
-@require_auth
-def control_curtain(request: Request, room_name: str, action: str, direction: str = None):
-    room_name = room_name.upper()
-    
+CONTROL_ACTIONS = ('up', 'down', 'stop')
+
+
+@lifecycle.inflight()
+def execute_control(room_name: str, action: str, direction: str = None, username: str = None) -> dict:
+    """
+    Send a curtain command to the room's controller and record it.
+
+    Returns the success message, and whether the command was skipped because the curtain
+    is already doing it (then neither the controller nor the statistics saw it).
+    """
     # In test mode, just return success
     if IS_TEST:
-        username = request.session.get('user_name')
+        if action in CONTROL_ACTIONS and not curtain_state.claim(room_name, direction, action, username):
+            return {"message": f"Curtain in room {room_name} is already going {action}.", "skipped": True}
         if username:
             users.add_room(username, room_name)
-        return {"status": "success", "message": f"Curtain in room {room_name} {action} command sent."}
+        return {"message": f"Curtain in room {room_name} {action} command sent.", "skipped": False}
     
     suffix = get_suffix(room_name)
     creds = (get_username(room_name), CURTAINS_PASSWORD)
@@ -305,32 +400,315 @@ def control_curtain(request: Request, room_name: str, action: str, direction: st
     else:
         raise HTTPException(status_code=400, detail="Invalid action. Choose 'up', 'down', or 'stop'.")
 
+    # The curtain is already doing this, no need to bother the controller
+    curtain = states.get('name')
+    if not curtain_state.claim(room_name, curtain, action, username):
+        logging.info(f"Skipping redundant {action} for room {room_name}")
+        return {"message": f"Curtain in room {room_name} is already going {action}.", "skipped": True}
+
     # Send the message to the server
-    res = send_message(operation_type, lift_direction, creds, address)
+    # Stop is idempotent, so it may be retried; up/down are sent at most once
+    retries = CONTROLLER_STOP_RETRIES if action == 'stop' else 0
+    try:
+        res = send_message(operation_type, lift_direction, creds, address, building=suffix, retries=retries)
+    except Exception:
+        curtain_state.forget(room_name, curtain)
+        raise
     if res.status_code == 200 or res.status_code == 202:
-        stats_manager.update_stats(room_name, action)
+        with phase('stats_update'):
+            stats_manager.update_stats(room_name, action)
+            analytics.safe_record(room_name, action)
         
         # Track room for user
-        username = request.session.get('user_name')
         if username:
             try:
                 users.add_room(username, room_name)
             except Exception as e:
                 logging.error(f"Failed to track room: {e}")
         
-        return {"status": "success", "message": f"Curtain in room {room_name} {action} command sent successfully."}
+        return {"message": f"Curtain in room {room_name} {action} command sent successfully.", "skipped": False}
     else:
+        curtain_state.forget(room_name, curtain)
         raise HTTPException(status_code=res.status_code, detail=f"Failed to send command {res.text}")
 
 
+def _run_control_job(job: dict) -> str:
+    return execute_control(job['room'], job['action'], job['direction'], job['username'])["message"]
+
+
+@app.on_event("startup")
+def start_job_dispatchers():
+    # Runs in each worker after the fork, so every worker dispatches jobs
+    if ASYNC_CONTROL:
+        jobs.start_dispatchers(_run_control_job)
+
+
+@app.on_event("startup")
+def start_scheduler():
+    schedules.start_scheduler(execute_control)
+
+
+@app.on_event("startup")
+def mark_started():
+    # Registered last, so the worker reports ready once everything above has started
+    lifecycle.mark_started()
+    lifecycle.install_signal_handler()
+
+
+# Draining stops new work; flushing persists what is buffered once in-flight commands are done
+lifecycle.on_drain(schedules.stop_scheduler)
+if ASYNC_CONTROL:
+    lifecycle.on_drain(jobs.stop_dispatchers)
+lifecycle.on_flush(reports.flush)
+
+
+@app.on_event("shutdown")
+def drain_and_flush():
+    lifecycle.shutdown()
+
+
+@app.get("/api/rooms/search")
+@require_auth
+def search_rooms(request: Request, q: str = '', building: str = None, limit: int = 10):
+    """Find rooms by prefix, falling back to close matches, optionally within one building"""
+    building = building.upper() if building else None
+    if building and building not in ('A', 'B', 'C'):
+        raise HTTPException(status_code=404, detail=f"incorrect building {building}")
+    if not 1 <= limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+    
+    index = get_room_index()
+    return conditional_response(request, index, lambda: JSONResponse(content={
+        "query": q,
+        "rooms": index.search(q, building, limit)
+    }))
+
+
+@app.get("/control/{room_name}/{action}")
+@require_auth
+@rate_limit('control', by=('user', 'room'))
+def control_curtain(request: Request, room_name: str, action: str, direction: str = None):
+    room_name = room_name.upper()
+    username = request.session.get('user_name')
+    lifecycle.check_accepting()
+    
+    if not ASYNC_CONTROL:
+        return {"status": "success", **execute_control(room_name, action, direction, username)}
+
+    # Reject what would fail anyway before queueing it
+    if action not in CONTROL_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action. Choose 'up', 'down', or 'stop'.")
+    if not IS_TEST:
+        get_suffix(room_name)
+        get_room_states(room_name)
+
+    job = jobs.enqueue(username, room_name, action, direction)
+    return JSONResponse(status_code=202, headers={"Location": f"/api/jobs/{job['id']}"}, content={
+        "status": "queued",
+        "job_id": job['id'],
+        "message": f"Curtain in room {room_name} {action} command queued."
+    })
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(request: Request, job_id: str, wait: float = 0):
+    """Get the status of a queued command; with wait, hold the request up to that many seconds until it ends."""
+    # Async so a long poll does not hold a threadpool thread; the lookups are local and fast
+    principal = get_principal(request)
+    if not principal:
+        raise HTTPException(status_code=401, detail="You need to authenticate")
+
+    job = jobs.get_job(job_id)
+    if job is None or (job['username'] != principal.username and not principal.is_admin):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    deadline = time.monotonic() + min(max(wait, 0), JOB_MAX_WAIT)
+    while job['status'] not in jobs.FINISHED_STATUSES and time.monotonic() < deadline:
+        await asyncio.sleep(jobs.WAIT_POLL_INTERVAL)
+        job = jobs.get_job(job_id)
+
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "room": job['room'],
+        "action": job['action'],
+        "created": job['created'],
+        "finished": job['finished'],
+        "status_code": job['status_code'],
+        "message": job['message']
+    }
+
+
+@app.get("/api/curtains/{room_name}/state")
+@require_auth
+def get_curtain_state(request: Request, room_name: str):
+    """Get the last commanded state of the room's curtains, without asking the controller."""
+    room_name = room_name.upper()
+    return {"room": room_name, "curtains": curtain_state.get_room_state(room_name)}
+
+
+def _validate_room(room_name: str):
+    """Reject a room that execute_control would reject."""
+    get_suffix(room_name)
+    if not IS_TEST:
+        get_room_states(room_name)
+
+
+@app.get("/api/schedules")
+@require_auth
+def get_schedules(request: Request, all: bool = False):
+    """Get the current user's schedules (admins may ask for everyone's)."""
+    principal = get_principal(request)
+    if all and not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "schedules": schedules.list_schedules(None if all else principal.username),
+        "leader": schedules.get_leader() if principal.is_admin else None
+    }
+
+
+@app.post("/api/schedules")
+@require_auth
+def create_schedule(request: Request, schedule: dict):
+    """Create a recurring command, e.g. {"rooms": ["4B210"], "action": "down", "time": "14:00", "days": ["mon", "fri"]}"""
+    principal = get_principal(request)
+    rooms = schedule.get('rooms') or ([schedule['room']] if schedule.get('room') else [])
+    rooms = [str(room).strip().upper() for room in rooms]
+    action = schedule.get('action')
+    days = schedule.get('days') or list(schedules.DAYS[:5])
+    at = str(schedule.get('time', ''))
+    direction = schedule.get('direction') or None
+    
+    if not rooms:
+        raise HTTPException(status_code=400, detail="At least one room is required")
+    if action not in CONTROL_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action. Choose 'up', 'down', or 'stop'.")
+    if not isinstance(days, list) or not days or any(str(day).lower()[:3] not in schedules.DAYS for day in days):
+        raise HTTPException(status_code=400, detail=f"days must be a list of {', '.join(schedules.DAYS)}")
+    try:
+        schedules.parse_time(at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="time must be HH:MM")
+    for room in rooms:
+        _validate_room(room)
+    if not principal.is_admin and schedules.count_schedules(principal.username) >= SCHEDULES_PER_USER:
+        raise HTTPException(status_code=400, detail=f"You can have at most {SCHEDULES_PER_USER} schedules")
+    
+    weekdays = [schedules.DAYS.index(str(day).lower()[:3]) for day in days]
+    return schedules.create_schedule(principal.username, rooms, action, weekdays, at, direction)
+
+
+def _get_own_schedule(request: Request, schedule_id: int) -> dict:
+    principal = get_principal(request)
+    schedule = schedules.get_schedule(schedule_id)
+    if schedule is None or (schedule['username'] != principal.username and not principal.is_admin):
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return schedule
+
+
+@app.post("/api/schedules/{schedule_id}/enabled/{enabled}")
+@require_auth
+def set_schedule_enabled(request: Request, schedule_id: int, enabled: bool):
+    """Pause or resume a schedule."""
+    _get_own_schedule(request, schedule_id)
+    schedules.set_enabled(schedule_id, enabled)
+    return schedules.get_schedule(schedule_id)
+
+
+@app.delete("/api/schedules/{schedule_id}")
+@require_auth
+def delete_schedule(request: Request, schedule_id: int):
+    """Delete a schedule."""
+    _get_own_schedule(request, schedule_id)
+    schedules.delete_schedule(schedule_id)
+    return {"status": "success", "message": f"Schedule {schedule_id} deleted"}
+
+
 @app.get("/stats/all")
 @require_auth
 def get_all_stats(request: Request):
     """Get statistics for all days"""
-    return {
-        "data": stats_manager.get_all_stats(),
-        "total_unique_rooms": stats_manager.get_total_unique_rooms_count()
-    }
+    with phase('stats_load'):
+        # Returned as a response so the large payload skips FastAPI's generic encoder
+        return FastJSONResponse({
+            "data": stats_manager.get_all_stats(),
+            "total_unique_rooms": stats_manager.get_total_unique_rooms_count()
+        })
+
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
+
+
+def _parse_export_date(value: str):
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date {value}, expected YYYY-MM-DD")
+
+
+@app.get("/stats/export")
+@require_auth
+def export_stats(request: Request, format: str = 'csv', start: str = None, end: str = None, rooms: str = None,
+                 building: str = None):
+    """Stream per-day statistics of every room, or of some rooms, between two dates as CSV or NDJSON"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Choose 'csv' or 'ndjson'.")
+    start, end = _parse_export_date(start), _parse_export_date(end)
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    building = building.upper() if building else None
+    _validate_analytics_filters(building, None)
+    room_filter = {room.strip().upper() for room in rooms.split(',') if room.strip()} if rooms else None
+
+    encode, media_type = EXPORT_FORMATS[format]
+    rows = stats_manager.iter_stats(start, end, room_filter, building)
+    filename = f"curtain_stats_{start or 'first'}_{end or 'last'}.{format}"
+    logging.info(f"Exporting statistics as {format} ({start or 'first'} to {end or 'last'})")
+    return StreamingResponse(encode(rows), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def _validate_analytics_filters(building: str, action: str):
+    if building and building not in ('A', 'B', 'C'):
+        raise HTTPException(status_code=400, detail=f"incorrect building {building}")
+    if action and action not in analytics.ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action. Choose 'up', 'down', or 'stop'.")
+
+
+@app.get("/api/analytics/heatmap")
+@require_auth
+def get_analytics_heatmap(request: Request, year: int = None, building: str = None, room: str = None,
+                          action: str = None):
+    """
+    Get commands per weekday/hour and per week of a year, for a room, a building or everything
+
+    Counting started with the analytics release; backfilled days (maintenance.py
+    backfill-analytics) appear in the weekly totals only, not in the weekday/hour heatmap.
+    """
+    building = building.upper() if building else None
+    _validate_analytics_filters(building, action)
+    with phase('stats_load'):
+        return analytics.get_heatmap(year or datetime.now().year, building, room.upper() if room else None, action)
+
+
+@app.get("/api/analytics/top-rooms")
+@require_auth
+def get_analytics_top_rooms(request: Request, year: int = None, building: str = None, action: str = None,
+                            limit: int = 10):
+    """Get the most used rooms of a year (days before the analytics release only once backfilled)"""
+    building = building.upper() if building else None
+    _validate_analytics_filters(building, action)
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    year = year or datetime.now().year
+    with phase('stats_load'):
+        return {"year": year, "building": building, "rooms": analytics.get_top_rooms(year, building, action, limit)}
 
 
 @app.get("/auth/callback")
@@ -375,36 +753,12 @@ def auth_callback(request: Request, code: str = None, state: str = None, error:
         username = graph_data.get("displayName", "Unknown User")
         logging.info(f'Graph result: {graph_data}')
         logging.info(f'Setting username to {username}')
-        request.session['user_name'] = username
-        
-        # Check if user is NEW before creating
-        is_new_user = not users.user_exists(username)
-        
-        # Save user to premium service
-        users.get_or_create_user(username)
+        start_session(request, username)
         
-        # Process pending referral ONLY if this is a new user
-        pending_referral = request.session.get('pending_referral')
-        if pending_referral and pending_referral != username and is_new_user:
-            users.process_referral(pending_referral, username)
-            users.add_points(pending_referral, 20)  # Grant 20 points for referral
-            
-            # Add success messages to both users
-            users.add_message(
-                pending_referral,
-                "success",
-                "Congratulations!",
-                f"{username} just signed up using your referral link! You got 20 points (you need 60 points to get Premium)! ✨"
-            )
-            users.add_message(
-                username,
-                "success",
-                "Thank You!",
-                f"{pending_referral} shared their referral link with you. They just earned 20 points thanks to you! 🎉"
-            )
-            
-            logging.info(f"Processed referral for {pending_referral} from NEW user {username}")
-            request.session.pop('pending_referral', None)
+        # Create the user and apply a pending referral in one transaction
+        pending_referral = request.session.pop('pending_referral', None)
+        if users.sign_in_user(username, pending_referral)['referral_applied']:
+            invalidate_principal(pending_referral)
         
         logging.info(f"Successfully authenticated user: {username}")
 
@@ -449,7 +803,7 @@ def get_premium_status(request: Request):
         raise HTTPException(status_code=401, detail="User not found in session")
     
     return {
-        "is_premium": users.is_premium(username),
+        "is_premium": get_principal(request).is_premium,
         "rooms": users.get_rooms(username)
     }
 
@@ -498,39 +852,12 @@ def handle_referral(request: Request, code: str):
     current_user = request.session.get('user_name')
     
     if current_user:
-        # User is logged in - if they're different from referrer and NEW, grant premium to referrer
+        # User is logged in - the referral only counts if they are new, otherwise they get a warning
         if current_user != referrer_username:
-            is_new_user = not users.user_exists(current_user)
-            logging.info(f"Referral check: current_user={current_user}, referrer={referrer_username}, is_new={is_new_user}")
-            if is_new_user:
-                users.process_referral(referrer_username, current_user)
-                users.add_points(referrer_username, 20)  # Grant 20 points for referral
-                
-                # Add success messages to both users
-                users.add_message(
-                    referrer_username,
-                    "success",
-                    "Congratulations!",
-                    f"{current_user} just signed up using your referral link! You got 20 points (you need 60 points to get Premium)! ✨"
-                )
-                users.add_message(
-                    current_user,
-                    "success",
-                    "Thank You!",
-                    f"{referrer_username} shared their referral link with you. They just earned 20 points thanks to you! 🎉"
-                )
-                
-                logging.info(f"NEW user {current_user} used referral from {referrer_username}")
-            else:
-                # Existing user tried to use referral - send warning message
-                logging.info(f"Adding warning message to {current_user} about {referrer_username}")
-                users.add_message(
-                    current_user,
-                    "warning",
-                    "Already Registered",
-                    f"You can't give premium to {referrer_username} because you are not a new user. Referral links only work for first-time sign-ups. 🙏"
-                )
-                logging.info(f"Existing user {current_user} tried to use referral from {referrer_username} - warning message added")
+            result = users.sign_in_user(current_user, referrer_username, warn_if_existing=True)
+            logging.info(f"Referral check: current_user={current_user}, referrer={referrer_username}, is_new={result['is_new_user']}")
+            if result['referral_applied']:
+                invalidate_principal(referrer_username)
         return RedirectResponse(url="/Frontend/index.html")
     
     # User not logged in - store referral and show message on home page
@@ -545,11 +872,12 @@ def handle_referral(request: Request, code: str):
 def get_chat_messages(request: Request):
     """Get all chat messages."""
     messages = users.get_chat_messages()
-    return {"messages": messages}
+    return FastJSONResponse({"messages": messages})
 
 
 @app.post("/api/chat/send")
 @require_auth
+@rate_limit('chat')
 def send_chat_message(request: Request, message: dict):
     """Send a chat message."""
     username = request.session.get('user_name')
@@ -565,7 +893,7 @@ def send_chat_message(request: Request, message: dict):
     if len(message_text) > 500:
         raise HTTPException(status_code=400, detail="Message too long (max 500 characters)")
     
-    is_premium = users.is_premium(username)
+    is_premium = get_principal(request).is_premium
     users.add_chat_message(username, message_text, is_premium)
     
     return {"status": "success", "message": "Message sent"}
@@ -578,7 +906,21 @@ def send_chat_message(request: Request, message: dict):
 def get_all_users_admin(request: Request):
     """Get all users data (admin only)."""
     all_users = users.get_all_users()
-    return {"users": all_users}
+    return FastJSONResponse({"users": all_users})
+
+
+@app.get("/api/admin/points/{username}")
+@require_admin
+def get_points_history_admin(request: Request, username: str, limit: int = 100):
+    """Get a user's points standing and ledger history (admin only)."""
+    if not 1 <= limit <= points.POINTS_HISTORY_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {points.POINTS_HISTORY_LIMIT}")
+    
+    users.ensure_points_ledger()
+    return {
+        **points.get_standing(username),
+        "history": points.get_history(username, limit)
+    }
 
 
 @app.get("/api/admin/grant-points/{username}/{points}")
@@ -592,6 +934,7 @@ def grant_points_admin(request: Request, username: str, points: int):
         raise HTTPException(status_code=404, detail=f"User {username} not found")
     
     users.add_points(username, points)
+    invalidate_principal(username)
     
     return {
         "status": "success",
@@ -627,3 +970,81 @@ def send_message_admin(request: Request, message_data: dict):
         "status": "success",
         "message": f"Message sent to {username}"
     }
+
+
+@app.get("/api/admin/slow-requests")
+@require_admin
+def get_slow_requests_admin(request: Request, limit: int = 50):
+    """Get the most recent slow request profiles (admin only)."""
+    return {
+        "enabled": PROFILING_ENABLED,
+        "threshold_ms": PROFILING_THRESHOLD_MS,
+        "requests": get_slow_requests(limit)
+    }
+
+
+@app.get("/api/admin/sessions")
+@require_admin
+def get_sessions_admin(request: Request):
+    """Get active server-side session counts per user (admin only)."""
+    return {
+        "store": SESSION_STORE,
+        "sessions": list_sessions()
+    }
+
+
+@app.post("/api/admin/sessions/revoke/{username}")
+@require_admin
+def revoke_sessions_admin(request: Request, username: str):
+    """Revoke all server-side sessions of a user (admin only)."""
+    if SESSION_STORE != 'server':
+        raise HTTPException(status_code=400, detail="Session revocation requires SESSION_STORE=server")
+    
+    revoked = revoke_user_sessions(username)
+    invalidate_principal(username)
+    
+    return {
+        "status": "success",
+        "message": f"Revoked {revoked} sessions of {username}"
+    }
+
+
+@app.get("/api/admin/reports")
+@require_admin
+def get_reports_admin(request: Request, offset: int = 0, limit: int = 50):
+    """Page through submitted reports, newest first (admin only)."""
+    if offset < 0 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 500")
+    
+    return reports.get_reports(offset, limit)
+
+
+@app.get("/api/admin/snapshots")
+@require_admin
+def get_snapshots_admin(request: Request):
+    """List the kept snapshots of all stores, newest first (admin only)."""
+    return {
+        "running": snapshots.is_running(),
+        "snapshots": snapshots.list_snapshots()
+    }
+
+
+@app.post("/api/admin/snapshots")
+@require_admin
+def create_snapshot_admin(request: Request):
+    """Start a snapshot of all stores in the background (admin only)."""
+    if not snapshots.start_snapshot():
+        raise HTTPException(status_code=409, detail="A snapshot is already running")
+    
+    return JSONResponse(status_code=202, content={
+        "status": "started",
+        "message": "Snapshot started, see GET /api/admin/snapshots"
+    })
+
+# ============== Preload ==============
+# With gunicorn --preload this module is imported once in the master. Build the read-only
+# data here so workers share it copy-on-write, and freeze it so the GC never touches
+# (and thereby copies) those pages. Per-worker state is rebuilt through utils.after_fork.
+load_rooms_data()
+get_room_index()
+gc.freeze()
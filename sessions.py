@@ -0,0 +1,167 @@
+"""
+Sessions module - resolves the signed-in principal once per request.
+
+The principal (username, admin flag, premium flag) is stored on request.state, so the
+auth decorators and handlers of one request share it. The admin flag is a set lookup;
+the premium flag and points are read from users storage lazily, in one read, and
+cached per user for PRINCIPAL_CACHE_TTL seconds. Changes made in this worker
+invalidate the entry at once; other workers see them within the TTL.
+
+With SESSION_STORE=server, each login also gets a session id recorded in SESSIONS_FILE.
+A cookie whose session id is missing from the store is treated as signed out, which
+is how sessions are revoked. The store is re-read only when the file changes.
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Optional
+
+from fastapi import Request
+
+from config import ADMIN_USERS, PRINCIPAL_CACHE_TTL, SESSION_STORE, SESSIONS_FILE
+from utils import atomic_write_json, file_lock, read_json
+import users
+
+_profile_cache = {}  # username -> (expires at, {"is_premium": ..., "points": ...})
+_store_cache = {"mtime": None, "sessions": {}}
+_store_lock = threading.Lock()
+
+
+class Principal:
+    """The authenticated user behind a request."""
+
+    def __init__(self, username: str, session_id: Optional[str] = None):
+        self.username = username
+        self.session_id = session_id
+        self.is_admin = username.lower() in ADMIN_USERS
+        self._profile = None
+
+    def _cached(self, key: str):
+        if self._profile is None:
+            self._profile = _cached_profile(self.username)
+        return self._profile[key]
+
+    @property
+    def is_premium(self) -> bool:
+        return self._cached("is_premium")
+
+    @property
+    def points(self) -> int:
+        return self._cached("points")
+
+
+def _cached_profile(username: str) -> dict:
+    """Premium flag and points of a user, read from users storage at most once per PRINCIPAL_CACHE_TTL."""
+    now = time.monotonic()
+    cached = _profile_cache.get(username)
+    if cached and cached[0] > now:
+        return cached[1]
+    user = users.get_user(username) or {}
+    profile = {"is_premium": user.get("is_premium", False), "points": user.get("points", 0)}
+    _profile_cache[username] = (now + PRINCIPAL_CACHE_TTL, profile)
+    return profile
+
+
+def invalidate(username: str):
+    """Forget cached flags for a user (in this worker) after they change."""
+    _profile_cache.pop(username, None)
+
+
+# ============== Server-side session store ==============
+
+def _load_store() -> dict:
+    """Get the session store, re-reading SESSIONS_FILE only when it changed."""
+    try:
+        mtime = os.stat(SESSIONS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _store_cache["mtime"] != mtime:
+        with _store_lock:
+            try:
+                _store_cache["sessions"] = read_json(SESSIONS_FILE)
+                _store_cache["mtime"] = mtime
+            except (ValueError, IOError) as e:
+                logging.error(f"Failed to read sessions file: {e}")
+    return _store_cache["sessions"]
+
+
+def _update_store(func):
+    """Apply func to the session store under the cross-worker lock and save it."""
+    with file_lock(SESSIONS_FILE):
+        try:
+            sessions = read_json(SESSIONS_FILE)
+        except (FileNotFoundError, ValueError):
+            sessions = {}
+        result = func(sessions)
+        atomic_write_json(SESSIONS_FILE, sessions)
+    return result
+
+
+def _server_store_enabled() -> bool:
+    return SESSION_STORE == 'server'
+
+
+def get_principal(request: Request) -> Optional[Principal]:
+    """Get the authenticated principal for this request, or None if signed out."""
+    if hasattr(request.state, 'principal'):
+        return request.state.principal
+
+    principal = None
+    username = request.session.get('user_name')
+    if username:
+        session_id = request.session.get('sid')
+        if not _server_store_enabled():
+            principal = Principal(username, session_id)
+        elif session_id and _load_store().get(session_id, {}).get('username') == username:
+            principal = Principal(username, session_id)
+
+    request.state.principal = principal
+    return principal
+
+
+def start_session(request: Request, username: str):
+    """Mark the request's session as signed in as username."""
+    request.session['user_name'] = username
+    if _server_store_enabled():
+        session_id = secrets.token_urlsafe(24)
+
+        def add(sessions):
+            sessions[session_id] = {"username": username, "created": int(time.time())}
+
+        _update_store(add)
+        request.session['sid'] = session_id
+    if hasattr(request.state, 'principal'):
+        del request.state.principal
+
+
+def end_session(request: Request):
+    """Sign the request's session out, revoking its server-side entry."""
+    session_id = request.session.get('sid')
+    if session_id and _server_store_enabled():
+        _update_store(lambda sessions: sessions.pop(session_id, None))
+    request.session.clear()
+    request.state.principal = None
+
+
+def revoke_user_sessions(username: str) -> int:
+    """Revoke every server-side session of a user. Returns how many were revoked."""
+    def revoke(sessions):
+        revoked = [sid for sid, entry in sessions.items() if entry.get('username') == username]
+        for sid in revoked:
+            del sessions[sid]
+        return len(revoked)
+
+    count = _update_store(revoke)
+    logging.info(f"Revoked {count} sessions of {username}")
+    return count
+
+
+def list_sessions() -> dict:
+    """Active server-side sessions per username."""
+    counts = {}
+    for entry in _load_store().values():
+        counts[entry['username']] = counts.get(entry['username'], 0) + 1
+    return counts
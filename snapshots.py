@@ -0,0 +1,424 @@
+"""
+Snapshots module - online, point-in-time backups of every store.
+
+A snapshot is taken in two phases. The capture is short: each store is frozen
+into a staging directory under the lock its writers already take, so requests
+wait at most for a few links:
+  - files replaced atomically (users, chat, sessions, daily stats, archives) are
+    hard-linked; writers replace the path with a new file and the link keeps
+    the captured version (copy-on-write at the file level)
+  - append-only logs (points ledger, reports) are hard-linked at their current
+    size, the log position; bytes appended later are ignored
+  - the analytics counters, updated in place, are copied under their lock
+  - the SQLite database is copied with SQLite's online backup
+
+The store phase holds no lock. Each file is kept as gzipped chunks named by their
+SHA-256 in SNAPSHOT_DIR/objects, and a manifest lists the chunks and checksum of
+every file. A file unchanged since the previous snapshot reuses its entry, a log
+that only grew reuses its chunks plus one chunk for the new bytes, and identical
+chunks are stored once, so each snapshot adds only what changed.
+
+Restore checks every checksum before writing anything. Stop the service first.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import points
+import users
+from config import ANALYTICS_DIR, DB_FILE, REPORTS_BACKUP_COUNT, REPORTS_FILE, SESSIONS_FILE, SNAPSHOT_DIR, \
+    SNAPSHOT_KEEP
+from utils import atomic_write_json, file_lock, read_json
+
+STATS_DIR = 'stats'  # StatisticsManager's default, used by the server
+BLOCK_SIZE = 1024 * 1024
+
+_thread = None
+
+
+def _objects_dir() -> str:
+    return os.path.join(SNAPSHOT_DIR, 'objects')
+
+
+def _manifests_dir() -> str:
+    return os.path.join(SNAPSHOT_DIR, 'manifests')
+
+
+def _object_path(digest: str) -> str:
+    return os.path.join(_objects_dir(), digest[:2], digest + '.gz')
+
+
+def _is_stats_file(filename: str) -> bool:
+    return ((filename.startswith('stats_') and filename.endswith('.csv'))
+            or (filename.startswith('archive_') and filename.endswith('.bin')))
+
+
+def _is_analytics_file(filename: str) -> bool:
+    return filename.startswith('usage_') and filename.endswith(('.bin', '.rooms'))
+
+
+# ============== Capture ==============
+
+class _Capture:
+    """Frozen copies of the stores in a staging directory: {store path: (staged path, size)}."""
+
+    def __init__(self, staging: str):
+        self.staging = staging
+        self.files = {}
+        self.databases = []
+
+    def _staged_path(self) -> str:
+        return os.path.join(self.staging, str(len(self.files)))
+
+    def link(self, path: str):
+        """Freeze a file replaced atomically or only appended to."""
+        staged = self._staged_path()
+        try:
+            os.link(path, staged)
+        except FileNotFoundError:
+            return
+        except OSError:
+            # No links here (e.g. another filesystem): a copy of the same version is as consistent
+            self.copy(path)
+            return
+        self.files[path] = (staged, os.path.getsize(staged))
+
+    def copy(self, path: str):
+        """Copy a file updated in place; call under the lock of its writers."""
+        staged = self._staged_path()
+        try:
+            shutil.copyfile(path, staged)
+        except FileNotFoundError:
+            return
+        self.files[path] = (staged, os.path.getsize(staged))
+
+    def backup_database(self, path: str):
+        if not os.path.exists(path):
+            return
+        staged = self._staged_path()
+        source, target = sqlite3.connect(path), sqlite3.connect(staged)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        self.files[path] = (staged, os.path.getsize(staged))
+        self.databases.append(path)
+
+
+def _capture(staging: str) -> _Capture:
+    capture = _Capture(staging)
+
+    with file_lock(users.USERS_FILE):
+        # Users and the points ledger change together under this lock
+        capture.link(users.USERS_FILE)
+        capture.link(points.POINTS_LEDGER_FILE)
+    capture.link(users.CHAT_FILE)
+    capture.link(SESSIONS_FILE)
+
+    if os.path.exists(REPORTS_FILE):
+        with file_lock(REPORTS_FILE):
+            # No rotation in between, so every report is in exactly one file
+            capture.link(REPORTS_FILE)
+            for index in range(1, REPORTS_BACKUP_COUNT + 1):
+                capture.link(f"{REPORTS_FILE}.{index}")
+
+    if os.path.isdir(STATS_DIR):
+        # No compaction in between, so every day is captured from some file
+        with file_lock(os.path.join(STATS_DIR, 'compact')):
+            for filename in sorted(os.listdir(STATS_DIR)):
+                if _is_stats_file(filename):
+                    capture.link(os.path.join(STATS_DIR, filename))
+
+    if os.path.isdir(ANALYTICS_DIR):
+        for filename in sorted(os.listdir(ANALYTICS_DIR)):
+            if filename.startswith('usage_') and filename.endswith('.bin'):
+                data_path = os.path.join(ANALYTICS_DIR, filename)
+                with file_lock(data_path):
+                    capture.copy(data_path)
+                    capture.copy(data_path[:-4] + '.rooms')
+
+    capture.backup_database(DB_FILE)
+    return capture
+
+
+# ============== Store ==============
+
+def _write_object(f, count: int, file_digest) -> str:
+    """Store the next `count` bytes of f as a chunk, also feeding them to file_digest. Returns the chunk's hash."""
+    digest = hashlib.sha256()
+    objects_dir = _objects_dir()
+    os.makedirs(objects_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=objects_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as out:
+            while count > 0:
+                block = f.read(min(BLOCK_SIZE, count))
+                if not block:
+                    raise IOError(f"{f.name} is shorter than captured")
+                digest.update(block)
+                file_digest.update(block)
+                out.write(block)
+                count -= len(block)
+        path = _object_path(digest.hexdigest())
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest()
+
+
+def _hash_prefix(f, count: int, digest) -> bool:
+    """Feed the first `count` bytes of f to digest; False if the file is shorter."""
+    while count > 0:
+        block = f.read(min(BLOCK_SIZE, count))
+        if not block:
+            return False
+        digest.update(block)
+        count -= len(block)
+    return True
+
+
+def _store_file(staged: str, size: int, previous: Optional[dict]) -> dict:
+    """Store the first `size` bytes of a staged file; returns its manifest entry."""
+    mtime_ns = os.stat(staged).st_mtime_ns
+    if previous and previous['size'] == size and previous['mtime_ns'] == mtime_ns:
+        return previous
+
+    with open(staged, 'rb') as f:
+        digest = hashlib.sha256()
+        chunks = []
+        if previous and 0 < previous['size'] <= size:
+            # A log that only grew keeps its old chunks
+            if _hash_prefix(f, previous['size'], digest) and digest.hexdigest() == previous['sha256']:
+                chunks = list(previous['chunks'])
+            else:
+                f.seek(0)
+                digest = hashlib.sha256()
+        start = f.tell()
+        if size > start or not chunks:
+            chunks.append(_write_object(f, size - start, digest))
+    return {"sha256": digest.hexdigest(), "size": size, "mtime_ns": mtime_ns, "chunks": chunks}
+
+
+def _latest_manifest() -> Optional[dict]:
+    ids = list_snapshot_ids()
+    return load_manifest(ids[-1]) if ids else None
+
+
+def list_snapshot_ids() -> list:
+    """Snapshot ids, oldest first."""
+    try:
+        names = os.listdir(_manifests_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+
+def load_manifest(snapshot_id: str) -> dict:
+    """Raises FileNotFoundError for an unknown snapshot."""
+    return read_json(os.path.join(_manifests_dir(), f"{os.path.basename(snapshot_id)}.json"))
+
+
+def _new_id() -> str:
+    base = datetime.now().strftime('%Y%m%d-%H%M%S')
+    existing = set(list_snapshot_ids())
+    snapshot_id, suffix = base, 1
+    while snapshot_id in existing:
+        suffix += 1
+        snapshot_id = f"{base}-{suffix}"
+    return snapshot_id
+
+
+def _prune():
+    """Keep the newest SNAPSHOT_KEEP snapshots and delete chunks no longer referenced."""
+    ids = list_snapshot_ids()
+    for snapshot_id in (ids[:-SNAPSHOT_KEEP] if SNAPSHOT_KEEP > 0 else []):
+        os.remove(os.path.join(_manifests_dir(), f"{snapshot_id}.json"))
+
+    referenced = set()
+    for snapshot_id in list_snapshot_ids():
+        for entry in load_manifest(snapshot_id)['files'].values():
+            referenced.update(entry['chunks'])
+    removed = 0
+    for directory, _, filenames in os.walk(_objects_dir()):
+        for filename in filenames:
+            if filename.endswith('.gz') and filename[:-3] not in referenced:
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+    if removed:
+        logging.info(f"Removed {removed} unreferenced snapshot chunks")
+
+
+def create_snapshot() -> dict:
+    """Take a snapshot of all stores; returns its summary."""
+    os.makedirs(_manifests_dir(), exist_ok=True)
+    with file_lock(os.path.join(SNAPSHOT_DIR, 'snapshot')):
+        # Leftovers of a snapshot interrupted by a restart
+        for name in os.listdir(SNAPSHOT_DIR):
+            if name.startswith('.staging-'):
+                shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+
+        snapshot_id = _new_id()
+        previous = _latest_manifest()
+        previous_files = previous['files'] if previous else {}
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=SNAPSHOT_DIR)
+        try:
+            started = time.perf_counter()
+            capture = _capture(staging)
+            capture_ms = (time.perf_counter() - started) * 1000
+
+            files = {path: _store_file(staged, size, previous_files.get(path))
+                     for path, (staged, size) in capture.files.items()}
+            manifest = {
+                "id": snapshot_id,
+                "created": time.time(),
+                "files": files,
+                "databases": capture.databases,
+                "directories": sorted({STATS_DIR, ANALYTICS_DIR}),
+            }
+            atomic_write_json(os.path.join(_manifests_dir(), f"{snapshot_id}.json"), manifest)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        _prune()
+
+    summary = _summarize(manifest, previous_files)
+    logging.info(f"Snapshot {snapshot_id}: {summary['files']} files, {summary['changed']} changed, "
+                 f"captured in {capture_ms:.0f}ms")
+    return summary
+
+
+def _summarize(manifest: dict, previous_files: Optional[dict] = None) -> dict:
+    summary = {
+        "id": manifest['id'],
+        "created": manifest['created'],
+        "files": len(manifest['files']),
+        "bytes": sum(entry['size'] for entry in manifest['files'].values()),
+    }
+    if previous_files is not None:
+        summary["changed"] = sum(1 for path, entry in manifest['files'].items() if previous_files.get(path) != entry)
+    return summary
+
+
+def list_snapshots() -> list:
+    """Summaries of the kept snapshots, newest first."""
+    return [_summarize(load_manifest(snapshot_id)) for snapshot_id in reversed(list_snapshot_ids())]
+
+
+def start_snapshot() -> bool:
+    """Take a snapshot in a background thread of this worker; False if one is already running here."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+
+    def run():
+        try:
+            create_snapshot()
+        except Exception as e:
+            logging.error(f"Snapshot failed: {e}")
+
+    _thread = threading.Thread(target=run, name='snapshot', daemon=True)
+    _thread.start()
+    return True
+
+
+def is_running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+# ============== Verify and restore ==============
+
+def _iter_chunks(entry: dict):
+    for chunk in entry['chunks']:
+        digest = hashlib.sha256()
+        with gzip.open(_object_path(chunk), 'rb') as f:
+            while block := f.read(BLOCK_SIZE):
+                digest.update(block)
+                yield block
+        if digest.hexdigest() != chunk:
+            raise ValueError(f"chunk {chunk} is corrupt")
+
+
+def verify(snapshot_id: str) -> list:
+    """Check every chunk and file checksum of a snapshot; returns the problems found."""
+    problems = []
+    for path, entry in load_manifest(snapshot_id)['files'].items():
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            for block in _iter_chunks(entry):
+                digest.update(block)
+                size += len(block)
+        except (OSError, EOFError, ValueError) as e:
+            problems.append(f"{path}: {e}")
+            continue
+        if size != entry['size'] or digest.hexdigest() != entry['sha256']:
+            problems.append(f"{path}: checksum mismatch")
+    return problems
+
+
+def _destination(path: str, target: Optional[str]) -> str:
+    if target is None:
+        return path
+    return os.path.join(target, os.path.relpath(path, '/') if os.path.isabs(path) else path)
+
+
+def restore(snapshot_id: str, target: Optional[str] = None) -> dict:
+    """
+    Restore a snapshot over the stores (or into the directory `target`). Every checksum
+    is verified first, and a snapshot with problems is not restored.
+    """
+    manifest = load_manifest(snapshot_id)
+    problems = verify(snapshot_id)
+    if problems:
+        raise ValueError(f"snapshot {snapshot_id} failed verification: {'; '.join(problems)}")
+
+    for path, entry in manifest['files'].items():
+        destination = _destination(path, target)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        tmp_path = f"{destination}.{os.getpid()}.restore"
+        with open(tmp_path, 'wb') as f:
+            for block in _iter_chunks(entry):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        if path in manifest['databases']:
+            # Through SQLite, so a write-ahead log next to the database is rewritten too
+            source, database = sqlite3.connect(tmp_path), sqlite3.connect(destination)
+            try:
+                source.backup(database)
+            finally:
+                source.close()
+                database.close()
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, destination)
+
+    # Data files created after the snapshot would mix with the restored ones
+    removed = 0
+    for directory in manifest['directories']:
+        destination_dir = _destination(directory, target)
+        if not os.path.isdir(destination_dir):
+            continue
+        for filename in os.listdir(destination_dir):
+            path = os.path.join(directory, filename)
+            if (_is_stats_file(filename) or _is_analytics_file(filename)) and path not in manifest['files']:
+                os.remove(os.path.join(destination_dir, filename))
+                removed += 1
+
+    logging.info(f"Restored snapshot {snapshot_id} ({len(manifest['files'])} files, {removed} newer files removed)")
+    return {**_summarize(manifest), "removed": removed}
@@ -1,8 +1,77 @@
 import os
 import csv
+import io
+import json
 import logging
+import threading
 from datetime import datetime
-import pandas as pd
+
+from stats_archive import StatsArchive, open_archive, write_archive
+from utils import file_lock
+
+STATS_COLUMNS = ['room_number', 'up', 'down', 'stop']
+EXPORT_COLUMNS = ['date', 'room_number', 'up', 'down', 'stop']
+ACTIONS = ('up', 'down', 'stop')
+EXPORT_CHUNK_ROWS = 500
+
+
+def iter_stats_file(filepath):
+    """Yield the rows of a daily statistics CSV one at a time, with integer counters per action"""
+    with open(filepath, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            yield {'room_number': row['room_number'], **{action: int(float(row.get(action) or 0)) for action in ACTIONS}}
+
+
+def read_stats_file(filepath):
+    """
+    Read a daily statistics CSV
+
+    Returns:
+        list: List of dictionaries with the room number and integer counters per action
+    """
+    return list(iter_stats_file(filepath))
+
+
+def _read_archive(path):
+    """All days of an archive as {date: rows}, unmapping it right after"""
+    with StatsArchive(path) as archive:
+        return archive.read_days()
+
+
+def write_stats_file(filepath, rows):
+    """Write a list of statistics rows to a daily CSV (atomically, a stopped worker never leaves a torn file)"""
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=STATS_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, filepath)
+
+
+def export_csv(rows):
+    """Encode export rows as CSV text, yielded in chunks of EXPORT_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_ndjson(rows):
+    """Encode export rows as one JSON object per line, yielded in chunks of EXPORT_CHUNK_ROWS rows"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n')
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
 
 
 class StatisticsManager:
@@ -22,26 +91,157 @@ class StatisticsManager:
             list: List of dictionaries containing date and statistics for each day
         """
         all_stats = []
-        stats_files = sorted(os.listdir(self.stats_dir), reverse=True)  # Sort in reverse to show newest first
+        sources = self._day_sources()
 
-        for filename in stats_files:
-            if filename.startswith('stats_') and filename.endswith('.csv'):
-                date = filename[6:-4]  # Extract date from filename
-                filepath = os.path.join(self.stats_dir, filename)
-                try:
-                    df = pd.read_csv(filepath)
-                    formatted_date = datetime.strptime(date, '%Y-%m-%d').strftime('%A, %B %d, %Y')
-                    all_stats.append({
-                        'date': formatted_date,
-                        'raw_date': date,
-                        'stats': df.to_dict('records'),
-                        'room_count': len(df['room_number'].unique())
-                    })
-                except Exception as e:
-                    logging.error(f"Error reading stats file {filename}: {e}")
+        for date in sorted(sources, reverse=True):  # Newest first
+            try:
+                rows = list(self._read_day(sources[date]))
+                formatted_date = datetime.strptime(date, '%Y-%m-%d').strftime('%A, %B %d, %Y')
+                all_stats.append({
+                    'date': formatted_date,
+                    'raw_date': date,
+                    'stats': rows,
+                    'room_count': len({row['room_number'] for row in rows})
+                })
+            except Exception as e:
+                logging.error(f"Error reading stats of {date}: {e}")
 
         return all_stats
 
+    def _listing(self):
+        """Daily files as {date: path}, and the paths of monthly and yearly archives"""
+        daily, monthly, yearly = {}, [], []
+        for filename in os.listdir(self.stats_dir):
+            path = os.path.join(self.stats_dir, filename)
+            if filename.startswith('stats_') and filename.endswith('.csv'):
+                daily[filename[6:-4]] = path
+            elif filename.startswith('archive_') and filename.endswith('.bin'):
+                (monthly if len(filename[8:-4]) == 7 else yearly).append(path)
+        return daily, sorted(monthly), sorted(yearly)
+
+    def _day_sources(self, start=None, end=None):
+        """
+        Map each day from start to end (inclusive 'YYYY-MM-DD') to where its rows are:
+        a daily file path, or (archive, position of the day)
+
+        Archives outside the range are not opened. A day found in several places (a
+        compaction interrupted before removing its inputs) is read from the newest form:
+        the daily file, then the monthly archive, then the yearly archive.
+        """
+        daily, monthly, yearly = self._listing()
+        sources = {}
+        for path in yearly + monthly:
+            period = os.path.basename(path)[8:-4]
+            if (start and period < start[:len(period)]) or (end and period > end[:len(period)]):
+                continue
+            try:
+                archive = open_archive(path)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error opening stats archive {path}: {e}")
+                continue
+            sources.update((date, (archive, position)) for position, date in enumerate(archive.dates))
+        sources.update(daily)
+        return {date: source for date, source in sources.items()
+                if not (start and date < start) and not (end and date > end)}
+
+    @staticmethod
+    def _read_day(source):
+        if isinstance(source, str):
+            return iter_stats_file(source)
+        archive, position = source
+        return archive.iter_rows(position)
+
+    def iter_stats(self, start=None, end=None, rooms=None, building=None):
+        """
+        Yield one row per room and day ({'date', 'room_number', 'up', 'down', 'stop'}), oldest first
+
+        Days are read one at a time (from daily files or archives) and rows are never
+        collected, so memory use does not grow with the date range.
+
+        Args:
+            start (str): First day, 'YYYY-MM-DD' (default: the oldest day)
+            end (str): Last day, 'YYYY-MM-DD' (default: the newest day)
+            rooms (set): Only these room numbers (upper case)
+            building (str): Only rooms of this building
+        """
+        sources = self._day_sources(start, end)
+        for date in sorted(sources):
+            try:
+                for row in self._read_day(sources[date]):
+                    room = row['room_number'].upper()
+                    if (rooms and room not in rooms) or (building and room[1:2] != building):
+                        continue
+                    yield {'date': date, **row}
+            except Exception as e:
+                logging.error(f"Error reading stats of {date}: {e}")
+
+    def compact(self, today=None, dry_run=False):
+        """
+        Roll the daily files of closed months into monthly archives, and the monthly
+        archives of closed years into yearly archives
+
+        Each archive is written (merged with an existing one) before its inputs are
+        removed, so an interrupted run loses nothing and the next run finishes it.
+
+        Returns:
+            dict: The months and years archived and the number of files removed
+        """
+        today = today or datetime.now().date()
+        current_month, current_year = today.strftime('%Y-%m'), today.strftime('%Y')
+        summary = {'months': [], 'years': [], 'files_removed': 0}
+
+        with file_lock(os.path.join(self.stats_dir, 'compact')):
+            daily, _, _ = self._listing()
+            closed_days = {}
+            for date, path in daily.items():
+                if date[:7] < current_month:
+                    closed_days.setdefault(date[:7], {})[date] = path
+
+            for month, paths in sorted(closed_days.items()):
+                archive_path = os.path.join(self.stats_dir, f"archive_{month}.bin")
+                summary['months'].append(month)
+                if dry_run:
+                    continue
+                days = _read_archive(archive_path) if os.path.exists(archive_path) else {}
+                days.update((date, read_stats_file(path)) for date, path in paths.items())
+                write_archive(archive_path, days)
+                self._remove(paths.values(), summary)
+
+            _, monthly, _ = self._listing()
+            # Includes the months just listed by a dry run
+            monthly = sorted(set(monthly) | {os.path.join(self.stats_dir, f"archive_{month}.bin")
+                                             for month in summary['months']})
+            closed_months = {}
+            for path in monthly:
+                year = os.path.basename(path)[8:12]
+                if year < current_year:
+                    closed_months.setdefault(year, []).append(path)
+
+            for year, paths in sorted(closed_months.items()):
+                archive_path = os.path.join(self.stats_dir, f"archive_{year}.bin")
+                summary['years'].append(year)
+                if dry_run:
+                    continue
+                days = _read_archive(archive_path) if os.path.exists(archive_path) else {}
+                for path in sorted(paths):
+                    days.update(_read_archive(path))
+                write_archive(archive_path, days)
+                self._remove(paths, summary)
+
+        if summary['months'] or summary['years']:
+            logging.info(f"Compacted statistics: months {summary['months']}, years {summary['years']}, "
+                         f"{summary['files_removed']} files removed")
+        return summary
+
+    @staticmethod
+    def _remove(paths, summary):
+        for path in paths:
+            try:
+                os.remove(path)
+                summary['files_removed'] += 1
+            except FileNotFoundError:
+                pass
+
     def get_stats_filename(self):
         """Generate statistics filename based on current date"""
         return os.path.join(self.stats_dir, f"stats_{datetime.now().strftime('%Y-%m-%d')}.csv")
@@ -50,9 +250,7 @@ class StatisticsManager:
         """Initialize the daily statistics file if it doesn't exist"""
         filename = self.get_stats_filename()
         if not os.path.exists(filename):
-            with open(filename, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['room_number', 'up', 'down', 'stop'])
+            write_stats_file(filename, [])
             logging.info(f"Created new statistics file: {filename}")
 
     def update_stats(self, room_number, action):
@@ -64,22 +262,22 @@ class StatisticsManager:
             action (str): The action performed ('up', 'down', or 'stop')
         """
         filename = self.get_stats_filename()
-        self.initialize_stats_file()
 
-        try:
-            df = pd.read_csv(filename)
-        except pd.errors.EmptyDataError:
-            df = pd.DataFrame(columns=['room_number', 'up', 'down', 'stop'])
-
-        # Check if room exists in stats
-        if room_number in df['room_number'].values:
-            df.loc[df['room_number'] == room_number, action] += 1
-        else:
-            new_row = {'room_number': room_number, 'up': 0, 'down': 0, 'stop': 0, action: 1}
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-
-        # Save updated stats
-        df.to_csv(filename, index=False)
+        # One lock for the directory, shared by all workers, so concurrent updates are not lost
+        with file_lock(os.path.join(self.stats_dir, 'stats')):
+            self.initialize_stats_file()
+            rows = read_stats_file(filename)
+
+            # Check if room exists in stats
+            for row in rows:
+                if row['room_number'] == room_number:
+                    row[action] += 1
+                    break
+            else:
+                rows.append({'room_number': room_number, 'up': 0, 'down': 0, 'stop': 0, action: 1})
+
+            # Save updated stats
+            write_stats_file(filename, rows)
         logging.info(f"Updated statistics for room {room_number}, action: {action}")
 
     def get_daily_stats(self):
@@ -94,8 +292,7 @@ class StatisticsManager:
             return []
 
         try:
-            df = pd.read_csv(filename)
-            return df.to_dict('records')
+            return read_stats_file(filename)
         except Exception as e:
             logging.error(f"Error reading statistics file: {e}")
             return []
@@ -112,8 +309,7 @@ class StatisticsManager:
             return 0
             
         try:
-            df = pd.read_csv(filename)
-            return len(df['room_number'].unique())
+            return len({row['room_number'] for row in read_stats_file(filename)})
         except Exception as e:
             logging.error(f"Error counting rooms in statistics file: {e}")
             return 0
@@ -126,15 +322,18 @@ class StatisticsManager:
             int: Total number of unique rooms that have used the curtain control
         """
         all_rooms = set()
-        stats_files = os.listdir(self.stats_dir)
-        
-        for filename in stats_files:
-            if filename.startswith('stats_') and filename.endswith('.csv'):
-                filepath = os.path.join(self.stats_dir, filename)
-                try:
-                    df = pd.read_csv(filepath)
-                    all_rooms.update(df['room_number'].unique())
-                except Exception as e:
-                    logging.error(f"Error reading stats file {filename}: {e}")
+        daily, monthly, yearly = self._listing()
+
+        for path in yearly + monthly:
+            try:
+                all_rooms.update(open_archive(path).rooms)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error opening stats archive {path}: {e}")
+
+        for filepath in daily.values():
+            try:
+                all_rooms.update(row['room_number'] for row in iter_stats_file(filepath))
+            except Exception as e:
+                logging.error(f"Error reading stats file {filepath}: {e}")
                     
-        return len(all_rooms)
\ No newline at end of file
+        return len(all_rooms)
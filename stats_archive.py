@@ -0,0 +1,141 @@
+"""
+Stats archive module - compact columnar archives of closed statistics days.
+
+StatisticsManager rolls the daily CSVs of a closed month into archive_<YYYY-MM>.bin,
+and the monthly archives of a closed year into archive_<YYYY>.bin. An archive is:
+
+    header   magic, version, number of days, rooms and rows, size of the room table
+    rooms    room numbers, newline separated (zero padded to 4 bytes)
+    days     per day: date ordinal, first row, row count              (uint32 x 3)
+    rows     four columns over all rows: room index, up, down, stop    (uint32 each)
+
+Readers memory-map the file and slice the columns of one day without parsing the
+rest, so a year of history is a single open file. The maps are cached per path and
+(inode, mtime, size); an entry whose file was replaced or removed is evicted and
+closed the next time an archive is mapped.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from datetime import date
+
+MAGIC = b'CSAR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIII')  # magic, version, reserved, days, rooms, rows, room table bytes
+ACTIONS = ('up', 'down', 'stop')
+
+_archives = {}  # path -> ((inode, mtime, size), StatsArchive)
+_lock = threading.Lock()
+
+
+def write_archive(path: str, days: dict):
+    """Write {'YYYY-MM-DD': [rows]} as an archive, atomically. Rows are statistics rows (room_number, up, down, stop)."""
+    rooms = {}
+    day_table = array('I')
+    columns = [array('I') for _ in range(1 + len(ACTIONS))]
+    for day in sorted(days):
+        rows = days[day]
+        day_table.extend((date.fromisoformat(day).toordinal(), len(columns[0]), len(rows)))
+        for row in rows:
+            columns[0].append(rooms.setdefault(row['room_number'], len(rooms)))
+            for column, action in zip(columns[1:], ACTIONS):
+                column.append(row[action])
+
+    room_table = '\n'.join(rooms).encode('utf-8')
+    room_table += b'\0' * (-len(room_table) % 4)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(days), len(rooms), len(columns[0]), len(room_table)))
+        f.write(room_table)
+        day_table.tofile(f)
+        for column in columns:
+            column.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StatsArchive:
+    """A memory-mapped archive; days are listed in date order."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, day_count, room_count, row_count, table_size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a statistics archive")
+
+        offset = HEADER.size
+        table = self._map[offset:offset + table_size].rstrip(b'\0').decode('utf-8')
+        self.rooms = table.split('\n') if room_count else []
+        offset += table_size
+
+        self._view = view = memoryview(self._map)
+        day_table = view[offset:offset + day_count * 12].cast('I').tolist()
+        offset += day_count * 12
+        self.dates = [date.fromordinal(ordinal).isoformat() for ordinal in day_table[0::3]]
+        self._ranges = list(zip(day_table[1::3], day_table[2::3]))
+        self._columns = []
+        for _ in range(1 + len(ACTIONS)):
+            self._columns.append(view[offset:offset + row_count * 4].cast('I'))
+            offset += row_count * 4
+
+    def iter_rows(self, position: int):
+        """Yield the statistics rows of the day at `position` in self.dates."""
+        first, count = self._ranges[position]
+        room_column, *counters = (column[first:first + count].tolist() for column in self._columns)
+        for index, room in enumerate(room_column):
+            yield {'room_number': self.rooms[room], **{action: column[index] for action, column in zip(ACTIONS, counters)}}
+
+    def read_days(self) -> dict:
+        """All days as {'YYYY-MM-DD': [rows]}, e.g. to merge into a larger archive."""
+        return {day: list(self.iter_rows(position)) for position, day in enumerate(self.dates)}
+
+    def close(self):
+        for column in self._columns:
+            column.release()
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_archive(path: str) -> StatsArchive:
+    """The archive at `path`, mapped once per process and re-mapped when the file is replaced."""
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    archive = _cached(path, key)
+    if archive is not None:
+        return archive
+    with _lock:
+        archive = _cached(path, key)
+        if archive is None:
+            # The file was replaced, or removed (e.g. months merged into a yearly archive)
+            for stale in [cached for cached in _archives if cached == path or not os.path.exists(cached)]:
+                _evict(stale)
+            archive = StatsArchive(path)
+            _archives[path] = (key, archive)
+    return archive
+
+
+def _cached(path: str, key: tuple):
+    cached = _archives.get(path)
+    return cached[1] if cached and cached[0] == key else None
+
+
+def _evict(path: str):
+    archive = _archives.pop(path)[1]
+    # Close the map now, unless a reader (e.g. a running export) still holds the archive:
+    # it is then unmapped when that reader lets go of it, instead of under its feet.
+    # The two references here are the local name and getrefcount's argument.
+    if sys.getrefcount(archive) <= 2:
+        archive.close()
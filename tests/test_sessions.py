@@ -0,0 +1,56 @@
+"""Principal cache: premium flag and points are read from users storage once per TTL."""
+
+import os
+
+import pytest
+
+os.environ.setdefault('IS_TEST', 'true')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    import server
+    import sessions
+    # Stores are relative to the working directory; keep them out of the tree
+    monkeypatch.chdir(tmp_path)
+    sessions._profile_cache.clear()
+    with TestClient(server.app) as client:
+        client.get('/login/test', params={'username': 'alice'}, follow_redirects=False)
+        yield client
+    sessions._profile_cache.clear()
+
+
+@pytest.fixture
+def user_reads(monkeypatch):
+    import users
+    reads = []
+    get_user = users.get_user
+
+    def counting_get_user(username):
+        reads.append(username)
+        return get_user(username)
+
+    monkeypatch.setattr(users, 'get_user', counting_get_user)
+    monkeypatch.setattr(users, 'is_premium', lambda username: pytest.fail("is_premium read past the cache"))
+    monkeypatch.setattr(users, 'get_points', lambda username: pytest.fail("get_points read past the cache"))
+    return reads
+
+
+def test_fresh_entry_is_served_from_cache(client, user_reads):
+    first = client.get('/check-auth').json()
+    second = client.get('/check-auth').json()
+    assert first == second
+    assert first['authenticated'] and first['username'] == 'alice'
+    assert user_reads == ['alice']
+
+
+def test_invalidate_forces_a_reread(client, user_reads):
+    import sessions
+    import users
+    client.get('/check-auth')
+    users.add_points('alice', 5, 'test')
+    assert client.get('/check-auth').json()['points'] == 0
+    sessions.invalidate('alice')
+    assert client.get('/check-auth').json()['points'] == 5
+    assert user_reads == ['alice', 'alice']
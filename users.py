@@ -3,12 +3,18 @@ Users module - manages user preferences, premium status, and favorite rooms.
 Uses a JSON file for storage.
 """
 
-import json
 import os
 import logging
+from functools import wraps
 from typing import Optional, List
 
+import points as ledger
+from profiling import phase
+from utils import atomic_write_json, file_lock, read_json
+
 USERS_FILE = os.getenv('USERS_FILE', 'users.json')
+REFERRAL_POINTS = 20
+PREMIUM_POINTS = 60
 
 
 def _load_users() -> dict:
@@ -16,8 +22,8 @@ def _load_users() -> dict:
     if not os.path.exists(USERS_FILE):
         return {}
     try:
-        with open(USERS_FILE, 'r') as f:
-            users = json.load(f)
+        with phase('storage_load'):
+            users = read_json(USERS_FILE)
             # Migrate old users to have messages field
             needs_save = False
             for username, user_data in users.items():
@@ -35,31 +41,44 @@ def _load_users() -> dict:
                     del user_data['referred_by']
                     needs_save = True
             if needs_save:
-                with open(USERS_FILE, 'w') as f:
-                    json.dump(users, f, indent=2)
+                atomic_write_json(USERS_FILE, users)
                 logging.info("Migrated users to message queue system")
             return users
-    except (json.JSONDecodeError, IOError):
+    except (ValueError, IOError):
         return {}
 
 
 def _save_users(users: dict):
-    """Save users to JSON file."""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    """Save users to JSON file (atomically, readers never see a partial file)."""
+    with phase('storage_save'):
+        atomic_write_json(USERS_FILE, users)
+
+
+def _locked(func):
+    """Run a read-modify-write of the users file under the lock shared by all workers."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with file_lock(USERS_FILE):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _new_user() -> dict:
+    return {
+        "is_premium": False,
+        "rooms": [],
+        "messages": [],
+        "points": 0
+    }
 
 
+@_locked
 def get_or_create_user(username: str) -> dict:
     """Get existing user or create a new one. Returns user dict."""
     users = _load_users()
     
     if username not in users:
-        users[username] = {
-            "is_premium": False,
-            "rooms": [],
-            "messages": [],
-            "points": 0
-        }
+        users[username] = _new_user()
         _save_users(users)
         logging.info(f"Created new user: {username}")
     
@@ -86,6 +105,7 @@ def is_premium(username: str) -> bool:
     return users.get(username, {}).get("is_premium", False)
 
 
+@_locked
 def set_premium(username: str, value: bool = True):
     """Set user's premium status."""
     users = _load_users()
@@ -95,6 +115,7 @@ def set_premium(username: str, value: bool = True):
         logging.info(f"Set premium={value} for user: {username}")
 
 
+@_locked
 def add_room(username: str, room: str):
     """Add a room to user's controlled rooms list (if not already there)."""
     users = _load_users()
@@ -138,16 +159,76 @@ def get_username_from_referral(code: str) -> Optional[str]:
         return None
 
 
-def process_referral(referrer_username: str, new_user: str) -> bool:
-    """Process a referral (points system handles premium grant). Returns True if successful."""
+@_locked
+def sign_in_user(username: str, referrer: Optional[str] = None, warn_if_existing: bool = False) -> dict:
+    """
+    Create the user on first sign-in and apply a referral, as one locked transaction.
+
+    A referral only counts for a new user and an existing referrer: the referrer gets
+    REFERRAL_POINTS (and premium at PREMIUM_POINTS) and both users get a message.
+    With warn_if_existing, an existing user following a referral link is told why it
+    did not count. Everything is saved in a single write, or not at all.
+
+    Returns:
+        dict: is_new_user, and whether the referral was applied
+    """
     users = _load_users()
-    if referrer_username in users:
-        # Premium is now granted automatically by points system at 60 points
-        logging.info(f"Processed referral for {referrer_username} from {new_user}")
-        return True
-    return False
+    is_new_user = username not in users
+    changed = is_new_user
+    referral_applied = False
+    grants = []
+    if is_new_user:
+        users[username] = _new_user()
+        logging.info(f"Created new user: {username}")
+
+    if referrer and referrer != username:
+        if is_new_user and referrer in users:
+            grants.append(_grant_points(users, referrer, REFERRAL_POINTS, "referral"))
+            _append_message(
+                users,
+                referrer,
+                "success",
+                "Congratulations!",
+                f"{username} just signed up using your referral link! You got {REFERRAL_POINTS} points (you need {PREMIUM_POINTS} points to get Premium)! ✨"
+            )
+            _append_message(
+                users,
+                username,
+                "success",
+                "Thank You!",
+                f"{referrer} shared their referral link with you. They just earned {REFERRAL_POINTS} points thanks to you! 🎉"
+            )
+            referral_applied = True
+            logging.info(f"Processed referral for {referrer} from NEW user {username}")
+        elif is_new_user:
+            logging.warning(f"Ignoring referral of {username} by unknown user {referrer}")
+        elif warn_if_existing:
+            _append_message(
+                users,
+                username,
+                "warning",
+                "Already Registered",
+                f"You can't give premium to {referrer} because you are not a new user. Referral links only work for first-time sign-ups. 🙏"
+            )
+            changed = True
+            logging.info(f"Existing user {username} tried to use referral from {referrer} - warning message added")
+
+    if changed:
+        _save_users(users)
+        _record_grants(grants)
 
+    return {"is_new_user": is_new_user, "referral_applied": referral_applied}
 
+
+def _append_message(users: dict, username: str, message_type: str, title: str, text: str):
+    users[username].setdefault("messages", []).append({
+        "type": message_type,
+        "title": title,
+        "text": text
+    })
+
+
+@_locked
 def add_message(username: str, message_type: str, title: str, text: str):
     """Add a message to user's message queue.
     
@@ -173,22 +254,43 @@ def add_message(username: str, message_type: str, title: str, text: str):
     logging.info(f"Added {message_type} message to {username}: '{title}' - Total messages for user: {len(users[username]['messages'])}")
 
 
+@_locked
 def get_and_clear_messages(username: str) -> list:
     """Get all pending messages for user and clear them."""
     users = _load_users()
     if username in users:
         messages = users[username].get("messages", [])
-        logging.info(f"get_and_clear_messages for {username}: Found {len(messages)} messages")
+        logging.debug(f"get_and_clear_messages for {username}: Found {len(messages)} messages")
         if messages:
-            logging.info(f"Messages for {username}: {messages}")
+            logging.debug(f"Messages for {username}: {messages}")
             users[username]["messages"] = []
             _save_users(users)
             logging.info(f"Cleared {len(messages)} messages for {username}")
         return messages
-    logging.info(f"get_and_clear_messages: User {username} not found")
+    logging.debug(f"get_and_clear_messages: User {username} not found")
     return []
 
 
+@_locked
+def get_user_snapshot(username: str) -> dict:
+    """Get profile, points, rooms and pending messages from a single load, clearing the messages."""
+    users = _load_users()
+    user_data = users.get(username, {})
+    messages = user_data.get("messages", [])
+    if messages:
+        users[username]["messages"] = []
+        _save_users(users)
+        logging.info(f"Cleared {len(messages)} messages for {username}")
+
+    return {
+        "username": username,
+        "is_premium": user_data.get("is_premium", False),
+        "points": user_data.get("points", 0),
+        "rooms": user_data.get("rooms", []),
+        "messages": messages
+    }
+
+
 # ============== Points Functions ==============
 
 def get_points(username: str) -> int:
@@ -197,21 +299,53 @@ def get_points(username: str) -> int:
     return users.get(username, {}).get("points", 0)
 
 
-def add_points(username: str, points: int):
-    """Add points to user's balance. Auto-grant premium at 60 points."""
+@_locked
+def add_points(username: str, points: int, reason: str = "admin"):
+    """Add points to user's balance. Auto-grant premium at PREMIUM_POINTS."""
     users = _load_users()
     if username not in users:
-        users[username] = {"is_premium": False, "rooms": [], "messages": [], "points": 0}
+        users[username] = _new_user()
     
+    grant = _grant_points(users, username, points, reason)
+    _save_users(users)
+    _record_grants([grant])
+
+
+def _grant_points(users: dict, username: str, points: int, reason: str) -> tuple:
+    """Add points in `users`. Returns the ledger entry; record it with _record_grants once users are saved."""
+    if not ledger.exists():
+        _seed_ledger(users)
     users[username]["points"] = users[username].get("points", 0) + points
     
-    # Auto-grant premium at 60 points
-    if users[username]["points"] >= 60 and not users[username].get("is_premium", False):
+    # Premium is evaluated for this user only, at the moment their balance crosses PREMIUM_POINTS
+    if users[username]["points"] >= PREMIUM_POINTS and not users[username].get("is_premium", False):
         users[username]["is_premium"] = True
-        logging.info(f"Auto-granted premium to {username} for reaching 60 points")
+        logging.info(f"Auto-granted premium to {username} for reaching {PREMIUM_POINTS} points")
     
-    _save_users(users)
     logging.info(f"Added {points} points to {username}, new total: {users[username]['points']}")
+    return username, points, reason
+
+
+def _record_grants(grants: list):
+    # Only after _save_users succeeded, so the ledger never holds points users.json does not
+    for username, points, reason in grants:
+        ledger.append(username, points, reason)
+
+
+def _seed_ledger(users: dict):
+    ledger.seed({username: user_data.get("points", 0) for username, user_data in users.items()})
+
+
+def ensure_points_ledger():
+    """Start the points ledger from users.json balances if it does not exist yet."""
+    if not ledger.exists():
+        _seed_missing_ledger()
+
+
+@_locked
+def _seed_missing_ledger():
+    if not ledger.exists():
+        _seed_ledger(_load_users())
 
 
 def get_all_users() -> dict:
@@ -229,16 +363,16 @@ def _load_chat() -> list:
     if not os.path.exists(CHAT_FILE):
         return []
     try:
-        with open(CHAT_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
+        with phase('chat_load'):
+            return read_json(CHAT_FILE)
+    except (ValueError, IOError):
         return []
 
 
 def _save_chat(messages: list):
-    """Save chat messages to JSON file."""
-    with open(CHAT_FILE, 'w') as f:
-        json.dump(messages, f, indent=2)
+    """Save chat messages to JSON file (atomically, readers never see a partial file)."""
+    with phase('chat_save'):
+        atomic_write_json(CHAT_FILE, messages)
 
 
 def add_chat_message(username: str, message: str, is_premium: bool = False):
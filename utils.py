@@ -1,78 +1,248 @@
+import atexit
+import fcntl
 import json
 import logging
+import logging.handlers
 import os
+import threading
 from datetime import datetime
+from contextlib import contextmanager
 from functools import wraps
+from queue import SimpleQueue
 
 import requests
 from dotenv import load_dotenv
 from fastapi import Request, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 ALLOWED_ISP = os.getenv('ALLOWED_ISP')
 
+# Logging: 'text' or 'json' lines, rotated by size (and daily if LOG_ROTATE_DAILY), keeping LOG_BACKUP_COUNT files
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '10'))
+LOG_ROTATE_DAILY = os.getenv('LOG_ROTATE_DAILY', 'false').lower() == 'true'
+# At most LOG_RATE_LIMIT INFO lines per call site every LOG_RATE_INTERVAL seconds (0 disables)
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))
+LOG_RATE_INTERVAL = float(os.getenv('LOG_RATE_INTERVAL', '1'))
+
+
+def after_fork(func):
+    """Register func to run in each forked worker (gunicorn --preload) to rebuild per-process state"""
+    os.register_at_fork(after_in_child=func)
+    return func
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock on `path`.lock, shared by all worker processes"""
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Responses serialized with orjson when it is installed (several times faster on large payloads)
+FastJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+def json_dumps(data) -> bytes:
+    """Compact UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def read_json(path: str):
+    """Parse a JSON file, with orjson when it is installed; raises ValueError on invalid JSON"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read()) if orjson is not None else json.load(f)
+
+
+def atomic_write_json(path: str, data):
+    """Write compact JSON to a temporary file and rename it over `path`, so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(json_dumps(data))
+    os.replace(tmp_path, path)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `limit` INFO/DEBUG records per call site through in each `interval` seconds"""
+
+    def __init__(self, limit: int, interval: float):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.windows = {}  # (pathname, lineno) -> [window start, records passed, records suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.limit <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or record.created - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [record.created, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.getMessage()} [{suppressed} similar messages suppressed]"
+                    record.args = None
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size (and optionally daily) rotating file handler that is safe with several worker processes.
+
+    Rotation happens under a lock file, and a process whose file was rotated by another
+    worker reopens the new file instead of rotating again.
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, daily=False):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.daily = daily
+        self.opened_day = datetime.now().date()
+
+    def _rotated_elsewhere(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except (OSError, AttributeError, ValueError):
+            return True
+
+    def _reopen(self):
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+        self.opened_day = datetime.now().date()
+
+    def shouldRollover(self, record):
+        if self.stream is not None and self._rotated_elsewhere():
+            self._reopen()
+        if self.daily and datetime.now().date() != self.opened_day:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.stream is not None and self._rotated_elsewhere():
+                self._reopen()
+                return
+            super().doRollover()
+            self.opened_day = datetime.now().date()
+
+
+_log_listener = None
+
+
+def _restart_log_listener():
+    """Logging threads do not survive fork, so each preloaded worker starts its own listener"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    queue_handler = next(handler for handler in logging.getLogger().handlers
+                         if isinstance(handler, logging.handlers.QueueHandler))
+    queue_handler.queue = SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, *_log_listener.handlers,
+                                                   respect_handler_level=True)
+    _log_listener.start()
+
 
 def setup_logging():
-    """Setup logging to both stdout and a timestamped log file"""
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    
+    """Setup asynchronous logging to stdout and a rotating log file.
+
+    Request threads only put records on a queue; a listener thread formats and writes them.
+    INFO/DEBUG lines are rate limited per call site so hot paths cannot flood the log.
+    """
+    global _log_listener
+
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
     # Get root logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    
+
     # Remove existing handlers to avoid duplicates
+    if _log_listener is not None:
+        _log_listener.stop()
     logger.handlers.clear()
-    
+
     # Console handler (stdout) - always add this first
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+    handlers = [console_handler]
+
     # Try to setup file logging
+    log_file = None
+    file_error = None
     try:
         # Use logs folder in the project directory
         project_root = os.path.dirname(os.path.abspath(__file__))
         log_dir = os.path.join(project_root, 'logs')
-        
-        # Create log directory if it doesn't exist
         os.makedirs(log_dir, exist_ok=True)
-        
-        # Find the next incremental number for the log file
-        next_number = 1
-        if os.path.exists(log_dir):
-            existing_files = os.listdir(log_dir)
-            # Extract numbers from filenames that match pattern: NNN_*.log
-            numbers = []
-            for filename in existing_files:
-                if filename.endswith('_run.log'):
-                    # Try to extract the number prefix
-                    parts = filename.split('_', 1)
-                    if len(parts) == 2:
-                        try:
-                            num = int(parts[0])
-                            numbers.append(num)
-                        except ValueError:
-                            pass
-            if numbers:
-                next_number = max(numbers) + 1
-        
-        # Create timestamped log filename with incremental prefix
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        log_file = os.path.join(log_dir, f'{next_number:03d}_{timestamp}_run.log')
-        
-        # File handler
-        file_handler = logging.FileHandler(log_file)
+
+        log_file = os.path.join(log_dir, 'curtains.log')
+        file_handler = SharedRotatingFileHandler(log_file, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+                                                 daily=LOG_ROTATE_DAILY)
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        
-        logging.info(f"Logging initialized. Log file: {log_file}")
+        handlers.append(file_handler)
     except Exception as e:
+        file_error = e
+
+    log_queue = SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_INTERVAL))
+    logger.addHandler(queue_handler)
+
+    first_setup = _log_listener is None
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    if first_setup:
+        atexit.register(lambda: _log_listener.stop())
+        after_fork(_restart_log_listener)
+
+    if file_error:
         # If file logging fails, at least we have console logging
-        logging.warning(f"Failed to setup file logging: {e}. Continuing with console logging only.")
+        logging.warning(f"Failed to setup file logging: {file_error}. Continuing with console logging only.")
+    else:
+        logging.info(f"Logging initialized. Log file: {log_file}")
 
 
 def is_allowed_isp(ip: str):